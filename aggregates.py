@@ -0,0 +1,144 @@
+# aggregates.py
+"""Per-user full-history summary (averages, best day) kept up to date from change events.
+
+A user's row is seeded with one SQL aggregate the first time the user is
+seen, then only new entry rows are folded in. last_row_id makes replays
+after a restart harmless, since entry ids only grow. Reads compare the row
+with the user's entry count and max id and reseed when they differ, which
+covers writes whose events never reached this process (change log off).
+"""
+import threading
+
+from sqlalchemy import Column, Date, Float, Integer, String, func
+
+import events
+import storage_sql
+from storage_sql import Base, Entry, EntryRollup
+
+METRICS = {
+    "focus": Entry.focus,
+    "cognitive": Entry.cognitive_score,
+    "sleep": Entry.sleep_hours,
+    "screen": Entry.screen_time,
+}
+
+_lock = threading.Lock()  # seeding from two threads would insert the same user twice
+
+class UserSummary(Base):
+    __tablename__ = "user_summary"
+    user = Column(String, primary_key=True)
+    last_row_id = Column(Integer, default=0)
+    n = Column(Integer, default=0)
+    focus_n = Column(Integer, default=0)
+    focus_sum = Column(Float, default=0.0)
+    cognitive_n = Column(Integer, default=0)
+    cognitive_sum = Column(Float, default=0.0)
+    sleep_n = Column(Integer, default=0)
+    sleep_sum = Column(Float, default=0.0)
+    screen_n = Column(Integer, default=0)
+    screen_sum = Column(Float, default=0.0)
+    best_cognitive = Column(Float)
+    best_date = Column(Date)
+
+def _seed(session, user):
+    cols = [func.count(Entry.id), func.max(Entry.id)]
+    for col in METRICS.values():
+        cols += [func.count(col), func.sum(col)]
+    row = session.query(*cols).filter(Entry.user==user).one()
+    s = UserSummary(user=user, n=row[0], last_row_id=row[1] or 0)
+    for i, name in enumerate(METRICS):
+        setattr(s, f"{name}_n", row[2 + 2*i] or 0)
+        setattr(s, f"{name}_sum", float(row[3 + 2*i] or 0.0))
+    # rows compacted by retention.py still count; best day stays a real day, so it comes from raw rows only
+    for r in session.query(EntryRollup).filter(EntryRollup.user==user):
+        s.n += r.n
+        for name, col in METRICS.items():
+            setattr(s, f"{name}_n", getattr(s, f"{name}_n") + getattr(r, f"{col.key}_n"))
+            setattr(s, f"{name}_sum", getattr(s, f"{name}_sum") + getattr(r, f"{col.key}_sum"))
+    best = (session.query(Entry.cognitive_score, Entry.entry_date)
+            .filter(Entry.user==user, Entry.cognitive_score.isnot(None))
+            .order_by(Entry.cognitive_score.desc(), Entry.entry_date).first())
+    if best:
+        s.best_cognitive, s.best_date = best
+    session.add(s)
+    return s
+
+def _fold(s, e):
+    s.n += 1
+    for name, col in METRICS.items():
+        v = getattr(e, col.key)
+        if v is not None:
+            setattr(s, f"{name}_n", getattr(s, f"{name}_n") + 1)
+            setattr(s, f"{name}_sum", getattr(s, f"{name}_sum") + float(v))
+    if e.cognitive_score is not None and (s.best_cognitive is None or e.cognitive_score > s.best_cognitive):
+        s.best_cognitive, s.best_date = e.cognitive_score, e.entry_date
+    s.last_row_id = max(s.last_row_id, e.id)
+
+def _ensure_table(user):
+    UserSummary.__table__.create(bind=storage_sql.engine_for(user), checkfirst=True)
+
+def apply_changes(changes):
+    # summaries sit on each user's shard, next to the entries they summarise
+    by_shard = {}
+    for c in changes:
+        if c.table == "entries" and c.user:
+            by_shard.setdefault(storage_sql.session_factory(c.user), (c.user, []))[1].append(c.row_id)
+    for factory, (user, ids) in by_shard.items():
+        with _lock:
+            _ensure_table(user)
+            _apply(factory, ids)
+
+def _apply(factory, ids):
+    session = factory()
+    try:
+        rows = session.query(Entry).filter(Entry.id.in_(ids)).order_by(Entry.id).all()
+        summaries = {}
+        for e in rows:
+            s = summaries.get(e.user) or session.get(UserSummary, e.user)
+            if s is None:
+                # seeding already counts this row and every earlier one
+                s = _seed(session, e.user)
+            summaries[e.user] = s
+            if e.id > s.last_row_id:
+                _fold(s, e)
+        session.commit()
+    finally:
+        session.close()
+
+def get_summary(user):
+    """Dict of avg_focus/avg_cognitive/avg_sleep/avg_screen/best_day, or None if unknown."""
+    with _lock:
+        _ensure_table(user)
+        return _get(user)
+
+def _current(session, user):
+    # (entries incl. rolled-up ones, max entry id): what a correct summary says
+    raw_n, max_id = session.query(func.count(Entry.id), func.max(Entry.id)).filter(Entry.user==user).one()
+    rolled = session.query(func.coalesce(func.sum(EntryRollup.n), 0)).filter(EntryRollup.user==user).scalar()
+    return raw_n + rolled, max_id or 0
+
+def _get(user):
+    session = storage_sql.session_for(user)
+    try:
+        s = session.get(UserSummary, user)
+        if s is not None and (s.n, s.last_row_id) != _current(session, user):
+            # rows written without an event reaching us (change log off and another
+            # process wrote them, or this consumer wasn't loaded): start over
+            session.delete(s)
+            session.flush()
+            s = None
+        if s is None:
+            s = _seed(session, user)
+            if not s.n:
+                session.rollback()
+                return None
+            session.commit()
+        out = {"entries": s.n, "best_day": s.best_date, "best_cognitive": s.best_cognitive}
+        for name in METRICS:
+            n = getattr(s, f"{name}_n")
+            out[f"avg_{name}"] = getattr(s, f"{name}_sum") / n if n else None
+        return out
+    finally:
+        session.close()
+
+events.subscribe("summary_aggregates", apply_changes, tables=("entries",), durable=True)
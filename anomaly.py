@@ -0,0 +1,218 @@
+# anomaly.py
+"""Flags unusual days (focus crash, sleep collapse, ...) as entries are saved.
+
+Each (user, metric) keeps running statistics in anomaly_state: a Welford
+mean/variance over the whole history and an EWMA mean/variance that
+follows recent drift. A new value is scored against the EWMA state from
+before it arrived, so an update is O(1) whatever the history length.
+Updates arrive as change events; last_row_id makes replays harmless.
+Rows past last_row_id that never arrived as events (change log off and
+another process wrote them) are folded in silently before a new batch.
+
+backfill() rebuilds the state from history in one pass and returns the
+anomalies it finds on the way.
+"""
+import math
+import threading
+from collections import namedtuple
+
+from sqlalchemy import Column, Float, Integer, String
+
+import events
+import storage_sql
+from storage_sql import Base, Entry
+
+# metric -> (label, bad direction, alert wording, floor for the std so flat histories don't alert on noise)
+METRICS = {
+    "focus": ("Focus", -1, "focus crash", 0.75),
+    "sleep_hours": ("Sleep", -1, "sleep collapse", 0.5),
+    "screen_time": ("Screen time", 1, "screen time spike", 0.5),
+    "cognitive_score": ("Cognitive score", -1, "cognitive score drop", 0.5),
+}
+EWM_ALPHA = 0.2
+Z_THRESHOLD = 2.5
+MIN_HISTORY = 7
+
+Anomaly = namedtuple("Anomaly", ["user", "date", "metric", "value", "expected", "z", "message"])
+
+_alert_hooks = []
+_lock = threading.Lock()
+
+class AnomalyState(Base):
+    __tablename__ = "anomaly_state"
+    user = Column(String, primary_key=True)
+    metric = Column(String, primary_key=True)
+    n = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    m2 = Column(Float, default=0.0)
+    ewm_mean = Column(Float, default=0.0)
+    ewm_var = Column(Float, default=0.0)
+    last_row_id = Column(Integer, default=0)
+
+def on_alert(fn):
+    # fn(anomalies) is called with a list of Anomaly; runs on the event dispatcher thread
+    _alert_hooks.append(fn)
+    return fn
+
+def _score(state, metric, value):
+    label, direction, wording, min_std = METRICS[metric]
+    if state.n < MIN_HISTORY:
+        return None
+    std = max(math.sqrt(max(state.ewm_var, 0.0)), min_std)
+    z = (value - state.ewm_mean) / std
+    if z * direction < Z_THRESHOLD:
+        return None
+    return z, (f"{wording}: {label} {value:g} vs usual {state.ewm_mean:.1f} "
+               f"(long-run {state.mean:.1f}, z={z:+.1f})")
+
+def _update(state, value):
+    # Welford
+    state.n += 1
+    delta = value - state.mean
+    state.mean += delta / state.n
+    state.m2 += delta * (value - state.mean)
+    # EWMA mean/variance, seeded with the first value
+    if state.n == 1:
+        state.ewm_mean, state.ewm_var = value, 0.0
+    else:
+        diff = value - state.ewm_mean
+        incr = EWM_ALPHA * diff
+        state.ewm_mean += incr
+        state.ewm_var = (1 - EWM_ALPHA) * (state.ewm_var + diff * incr)
+
+def _observe(states, e):
+    found = []
+    for metric, state in states.items():
+        value = getattr(e, metric)
+        if value is not None:
+            value = float(value)
+            hit = _score(state, metric, value)
+            if hit:
+                z, msg = hit
+                found.append(Anomaly(e.user, e.entry_date, metric, value, state.ewm_mean, z, f"{e.user} {e.entry_date}: {msg}"))
+            _update(state, value)
+        # advanced for every metric so the replay check below stays simple
+        state.last_row_id = max(state.last_row_id or 0, e.id)
+    return found
+
+def _states(session, user, cache):
+    """Returns (states, created); created means this user had no stored state."""
+    if user in cache:
+        return cache[user], False
+    states, created = {}, False
+    for metric in METRICS:
+        s = session.get(AnomalyState, (user, metric))
+        if s is None:
+            s = AnomalyState(user=user, metric=metric, n=0, mean=0.0, m2=0.0, ewm_mean=0.0, ewm_var=0.0, last_row_id=0)
+            session.add(s)
+            created = True
+        states[metric] = s
+    cache[user] = states
+    return states, created
+
+def _seed(session, states, user, exclude_ids, after=0):
+    # a user first seen mid-history starts from their earlier rows, silently;
+    # with after, only rows past the stored state (writes we got no event for)
+    rows = (session.query(Entry)
+            .filter(Entry.user==user, Entry.entry_date.isnot(None), Entry.id > after, Entry.id.notin_(exclude_ids))
+            .order_by(Entry.entry_date, Entry.id).yield_per(1000))
+    for e in rows:
+        _observe(states, e)
+
+def _ensure_table(engine):
+    AnomalyState.__table__.create(bind=engine, checkfirst=True)
+
+def _emit(found):
+    if found:
+        for hook in _alert_hooks:
+            hook(found)
+
+def apply_changes(changes):
+    by_shard = {}
+    for c in changes:
+        if c.table == "entries" and c.user:
+            by_shard.setdefault(storage_sql.session_factory(c.user), []).append(c.row_id)
+    found = []
+    for factory, ids in by_shard.items():
+        _ensure_table(factory.kw["bind"])
+        with _lock:
+            session = factory()
+            try:
+                cache, seen = {}, {}
+                for e in session.query(Entry).filter(Entry.id.in_(ids)).order_by(Entry.id).all():
+                    states, created = _states(session, e.user, cache)
+                    if e.user not in seen:
+                        # replays are judged by the stored position, before any catch-up
+                        seen[e.user] = 0 if created else states["focus"].last_row_id
+                        # with the change log off, writes from other processes never
+                        # arrive as events; fold them in before scoring this batch
+                        _seed(session, states, e.user, ids, after=seen[e.user])
+                    if e.id <= seen[e.user]:
+                        continue
+                    found.extend(_observe(states, e))
+                session.commit()
+            finally:
+                session.close()
+    _emit(found)
+    return found
+
+def backfill(users=None):
+    """Recompute state from full history in date order; returns every anomaly found."""
+    wanted = set([users] if isinstance(users, str) else users) if users else None
+    factories = (list(dict.fromkeys(storage_sql.session_factory(u) for u in wanted))
+                 if wanted else storage_sql.all_session_factories())
+    found = []
+    for factory in factories:
+        _ensure_table(factory.kw["bind"])
+        with _lock:
+            session = factory()
+            try:
+                q = session.query(AnomalyState)
+                if wanted:
+                    q = q.filter(AnomalyState.user.in_(wanted))
+                q.delete(synchronize_session=False)
+                rows = session.query(Entry).filter(Entry.user.isnot(None), Entry.entry_date.isnot(None))
+                if wanted:
+                    rows = rows.filter(Entry.user.in_(wanted))
+                cache = {}
+                for e in rows.order_by(Entry.user, Entry.entry_date, Entry.id).yield_per(1000):
+                    found.extend(_observe(_states(session, e.user, cache)[0], e))
+                session.commit()
+            finally:
+                session.close()
+    return found
+
+def get_state(user):
+    """{metric: {"n", "mean", "std", "ewm_mean", "ewm_std"}} for one user."""
+    factory = storage_sql.session_factory(user)
+    _ensure_table(factory.kw["bind"])
+    session = factory()
+    try:
+        out = {}
+        for s in session.query(AnomalyState).filter(AnomalyState.user==user).all():
+            out[s.metric] = {
+                "n": s.n,
+                "mean": s.mean,
+                "std": math.sqrt(s.m2 / (s.n - 1)) if s.n > 1 else 0.0,
+                "ewm_mean": s.ewm_mean,
+                "ewm_std": math.sqrt(max(s.ewm_var, 0.0)),
+            }
+        return out
+    finally:
+        session.close()
+
+events.subscribe("anomaly_detection", apply_changes, tables=("entries",), durable=True)
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Rebuild anomaly state from history and list anomalous days")
+    ap.add_argument("users", nargs="*", help="limit to these users (default: everyone)")
+    args = ap.parse_args()
+    storage_sql.init_db()
+    found = backfill(args.users or None)
+    for a in found:
+        print(a.message)
+    print(f"{len(found)} anomalies.")
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,18 @@ from tkcalendar import DateEntry
 from datetime import datetime, date
 import pandas as pd
 import os
+import queue
+import time
 
 # Local modules (must exist)
-from storage_sql import init_db, add_entry, query_entries, get_users, add_habit, query_habits
+from storage_sql import init_db, add_entry, query_entries, get_users, add_habit, query_habits, import_entries_df, search_notes
 from logic import compute_cognitive_score, rule_based_advice, generate_insights
 from viz import figure_focus_trend, figure_cognitive_trend, figure_mood_pie
+import events
+import aggregates
+import anomaly
+import overview
+import jobs
 
 # optional report and ml modules
 try:
@@ -44,6 +51,10 @@ ACCENT = "#0b63d4"
 CARD = "#e9f2ff"
 TXT = "#0b0b0b"
 BTN = "#2b8cff"
+SEARCH_PAGE = 20
+CHANGE_POLL_MS = 300
+CHANGE_CATCH_UP_SECONDS = 1
+OVERVIEW_COLS = 4
 
 # utilities
 def safe_float(v, default=0.0):
@@ -90,6 +101,9 @@ class ADHDApp:
         self.to_date = DateEntry(top, width=12)
         self.to_date.pack(side="left", padx=4)
 
+        self.overview_btn = tk.Button(top, text="All Users", command=self.show_overview, bg=BTN, fg="white")
+        self.overview_btn.pack(side="right", padx=6)
+
         # theme toggle
         self.dark = False
         self.toggle_btn = tk.Button(top, text="Toggle Dark", command=self.toggle_theme, bg=BTN, fg="white")
@@ -179,6 +193,19 @@ class ADHDApp:
         self.scr_mins = tk.Entry(self.sidebar, width=12); self.scr_mins.insert(0,"0"); self.scr_mins.pack(padx=s_padx, pady=(0,8))
         tk.Button(self.sidebar, text="Save Habit", bg="#5b8c5a", fg="white", command=self.save_habit).pack(padx=s_padx, pady=(4,12))
 
+        # notes search
+        tk.Label(self.sidebar, text="Search Notes", bg=PANEL, font=("Helvetica",11,"bold")).pack(anchor="w", padx=s_padx, pady=(6,4))
+        search_row = tk.Frame(self.sidebar, bg=PANEL)
+        search_row.pack(fill="x", padx=s_padx)
+        self.search_e = tk.Entry(search_row, width=22)
+        self.search_e.pack(side="left")
+        self.search_e.bind("<Return>", lambda e: self.on_search())
+        tk.Button(search_row, text="Search", bg=BTN, fg="white", command=self.on_search).pack(side="left", padx=4)
+        tk.Button(search_row, text="More", command=lambda: self.on_search(more=True)).pack(side="left")
+        self.search_box = tk.Text(self.sidebar, height=8, width=42)
+        self.search_box.pack(padx=s_padx, pady=(6,12))
+        self._search_offset = 0
+
         # output text
         tk.Label(self.sidebar, text="System Output", bg=PANEL).pack(anchor="w", padx=s_padx)
         self.output_txt = tk.Text(self.sidebar, height=8, width=42)
@@ -222,10 +249,73 @@ class ADHDApp:
         # scheduler
         self.scheduler = BackgroundScheduler()
         self.scheduler.start()
+        jobs.schedule(self.scheduler)
+        # data changes (ours or, with the change log on, other processes') drive refreshes.
+        # Offsets are shared through the database, so each window needs its own consumer name.
+        self._changes = queue.Queue()
+        self._alerts = queue.Queue()
+        self._ui = queue.Queue()  # callables from worker threads, run on the Tk loop
+        self._overview_busy = False
+        self._consumer = f"dashboard.{os.getpid()}.{int(time.time())}"
+        events.subscribe(self._consumer, self._changes.put, durable=True)
+        anomaly.on_alert(self._alerts.put)
+        events.seek_to_end(self._consumer)
+        # catch_up takes the bus lock, which consumers hold while they run (report
+        # regeneration, anomaly seeding); poll from a scheduler thread, not from Tk
+        self.scheduler.add_job(events.catch_up, "interval", args=[self._consumer], seconds=CHANGE_CATCH_UP_SECONDS,
+                               max_instances=1, coalesce=True, id="dashboard_changes")
+        self.root.after(CHANGE_POLL_MS, self._poll_changes)
         # initial
         self.refresh_user_list()
         self.refresh_dashboard()
 
+    def close(self):
+        self.scheduler.shutdown(wait=False)
+        events.forget(self._consumer)
+
+    def _poll_changes(self):
+        # events arrive on other threads; Tk is only touched here, on the main loop
+        changes = []
+        while True:
+            try:
+                changes.extend(self._changes.get_nowait())
+            except queue.Empty:
+                break
+        if changes:
+            self.on_data_changed(changes)
+        while True:
+            try:
+                self.show_alerts(self._alerts.get_nowait())
+            except queue.Empty:
+                break
+        while True:
+            try:
+                self._ui.get_nowait()()
+            except queue.Empty:
+                break
+        self.root.after(CHANGE_POLL_MS, self._poll_changes)
+
+    def show_alerts(self, found):
+        for a in found:
+            self.output_txt.insert("end", f"⚠ {a.message}\n")
+        self.output_txt.see("end")
+        if notifier is not None and found:
+            try:
+                notifier.show_toast("ADHD Monitor — unusual day", found[0].message, duration=5, threaded=True)
+            except Exception:
+                pass
+
+    def on_data_changed(self, changes):
+        users = {c.user for c in changes}
+        if not users.issubset(self.user_combo["values"]):
+            self.refresh_user_list()
+        current = self.user_var.get() or None
+        if current in users:
+            if any(c.table == "entries" for c in changes):
+                self.refresh_dashboard()
+            else:
+                self.refresh_habits()
+
     def _make_card(self, parent, title, value):
         f = tk.Frame(parent, bg=CARD, padx=10, pady=8)
         f.pack(side="left", padx=8, pady=4)
@@ -269,8 +359,6 @@ class ADHDApp:
             row = self.build_row_from_inputs()
             add_entry(row)
             self.output_txt.insert("end", f"Saved: {row['user']} {row['entry_date']} → Cog: {row['cognitive_score']}\n")
-            self.refresh_user_list()
-            self.refresh_dashboard()
         except Exception as e:
             messagebox.showerror("Save error", str(e))
 
@@ -286,10 +374,87 @@ class ADHDApp:
             }
             add_habit(h)
             self.output_txt.insert("end", f"Habit saved: {h['user']} {h['date']}\n")
-            self.refresh_habits()
         except Exception as e:
             messagebox.showerror("Habit save error", str(e))
 
+    def on_search(self, more=False):
+        q = self.search_e.get().strip()
+        if not q:
+            return
+        self._search_offset = self._search_offset + SEARCH_PAGE if more else 0
+        user = self.user_var.get() or None
+        start, end = (self.from_date.get_date(), self.to_date.get_date()) if self.use_range_var.get() else (None, None)
+        t0 = time.perf_counter()
+        df = search_notes(user, q, start_date=start, end_date=end, limit=SEARCH_PAGE, offset=self._search_offset)
+        ms = (time.perf_counter() - t0) * 1000
+        if not more:
+            self.search_box.delete("1.0", "end")
+        if df.empty:
+            self.search_box.insert("end", "No more matches.\n" if more else f"No matches ({ms:.0f} ms).\n")
+            return
+        self.search_box.insert("end", f"Results {self._search_offset+1}-{self._search_offset+len(df)} ({ms:.0f} ms)\n")
+        for _, r in df.iterrows():
+            self.search_box.insert("end", f"{r['Date']} {r['Name']} [{r['Source']}]: {r['Snippet']}\n")
+        self.search_box.see("end")
+
+    def show_overview(self):
+        # sparklines render on a scheduler thread (in spawned worker processes when
+        # many changed); the window is built back on the Tk loop once they are done
+        if self._overview_busy:
+            return
+        self._overview_busy = True
+        self.output_txt.insert("end", "Overview: rendering sparklines...\n")
+        self.scheduler.add_job(self._build_overview)
+
+    def _build_overview(self):
+        try:
+            tiles, rendered = overview.build_overview()
+        except Exception as e:
+            self._ui.put(lambda e=e: self._overview_failed(e))
+        else:
+            self._ui.put(lambda: self._show_overview(tiles, rendered))
+
+    def _overview_failed(self, e):
+        self._overview_busy = False
+        messagebox.showerror("Overview", f"Could not build the overview: {e}")
+
+    def _show_overview(self, tiles, rendered):
+        self._overview_busy = False
+        if not tiles:
+            messagebox.showinfo("Overview", "No data yet.")
+            return
+        win = tk.Toplevel(self.root)
+        win.title(f"All Users ({len(tiles)})")
+        win.configure(bg=BG)
+        canvas = tk.Canvas(win, bg=BG, highlightthickness=0, width=OVERVIEW_COLS*260, height=560)
+        scroll = ttk.Scrollbar(win, orient="vertical", command=canvas.yview)
+        grid = tk.Frame(canvas, bg=BG)
+        grid.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+        canvas.create_window((0,0), window=grid, anchor="nw")
+        canvas.configure(yscrollcommand=scroll.set)
+        canvas.pack(side="left", fill="both", expand=True)
+        scroll.pack(side="right", fill="y")
+        win._images = []  # Tk drops images that Python no longer references
+        fmt = lambda v: "-" if v is None or pd.isna(v) else f"{v:.1f}"
+        for i, t in enumerate(tiles):
+            tile = tk.Frame(grid, bg=CARD, padx=6, pady=6)
+            tile.grid(row=i // OVERVIEW_COLS, column=i % OVERVIEW_COLS, padx=6, pady=6, sticky="nsew")
+            tk.Label(tile, text=t["user"], bg=CARD, font=("Helvetica",11,"bold")).pack(anchor="w")
+            img = tk.PhotoImage(file=t["sparkline"])
+            win._images.append(img)
+            tk.Label(tile, image=img, bg=CARD).pack()
+            tk.Label(tile, bg=CARD, justify="left", font=("Helvetica",9),
+                     text=f"Focus {fmt(t['avg_focus'])}  Cognitive {fmt(t['avg_cognitive'])}\n"
+                          f"Sleep {fmt(t['avg_sleep'])}  Screen {fmt(t['avg_screen'])}\n"
+                          f"{t['entries']} entries, last {t['last_date']}").pack(anchor="w")
+            for w in (tile, *tile.winfo_children()):
+                w.bind("<Button-1>", lambda e, u=t["user"]: self._open_user(u))
+        self.output_txt.insert("end", f"Overview: {len(tiles)} users, {rendered} sparklines redrawn.\n")
+
+    def _open_user(self, user):
+        self.user_var.set(user)
+        self.refresh_dashboard()
+
     def on_toggle_range(self):
         # if unchecked, ignore dates (full-history)
         self.refresh_dashboard()
@@ -316,26 +481,12 @@ class ADHDApp:
             return
         try:
             df = pd.read_excel(p, engine="openpyxl")
-            for _, r in df.iterrows():
-                entry = {
-                    "user": r.get("Name") or "Unknown",
-                    "entry_date": pd.to_datetime(r.get("Date")).date() if not pd.isna(r.get("Date")) else datetime.today().date(),
-                    "focus": int(r.get("Focus") or 0),
-                    "hyperactivity": int(r.get("Hyperactivity") or 0),
-                    "impulsivity": int(r.get("Impulsivity") or 0),
-                    "sleep_hours": float(r.get("Sleep Hours") or 0),
-                    "distractions": int(r.get("Distractions") or 0),
-                    "tasks_completed": int(r.get("Tasks Completed") or 0),
-                    "mood": r.get("Mood") or "",
-                    "notes": r.get("Notes") or "",
-                    "cognitive_score": float(r.get("Cognitive Score") or 0),
-                    "advice": r.get("Advice") or "",
-                    "screen_time": float(r.get("Screen Time") or 0.0)
-                }
-                add_entry(entry)
-            messagebox.showinfo("Imported", "Excel imported into database.")
-            self.refresh_user_list()
-            self.refresh_dashboard()
+            n, failed = import_entries_df(df, source=p)
+            if failed:
+                # report spreadsheet row numbers (header is row 1)
+                rows = ", ".join(str(i + 2) for i in failed[:20]) + (" ..." if len(failed) > 20 else "")
+                self.output_txt.insert("end", f"Skipped {len(failed)} row(s) with unreadable dates: {rows}\n")
+            messagebox.showinfo("Imported", f"Excel imported into database ({n} rows).")
         except Exception as e:
             messagebox.showerror("Import error", str(e))
 
@@ -367,7 +518,7 @@ class ADHDApp:
             messagebox.showwarning("Predict", "Select or enter a user first.")
             return
         try:
-            pred = predict_next_day(user)
+            pred = jobs.get("prediction", user)
             if pred is None:
                 self.output_txt.insert("end", "No trained model available or not enough data. Train model for this user first.\n")
             else:
@@ -381,7 +532,7 @@ class ADHDApp:
             if self.use_range_var.get():
                 df = query_entries(user=user, start_date=self.from_date.get_date(), end_date=self.to_date.get_date())
             else:
-                df = query_entries(user=user)
+                df = jobs.get("entries", user)
         else:
             df = None
 
@@ -402,16 +553,24 @@ class ADHDApp:
         df_num["Sleep Hours"] = pd.to_numeric(df_num["Sleep Hours"], errors="coerce")
         df_num["Screen Time"] = pd.to_numeric(df_num["Screen Time"], errors="coerce")
 
-        # cards
-        avg_focus = df_num["Focus"].mean()
-        avg_cog = df_num["Cognitive Score"].mean()
-        avg_sleep = df_num["Sleep Hours"].mean()
-        avg_screen = df_num["Screen Time"].mean()
+        # cards: full history comes from the summary kept current by change events
+        summary = None if self.use_range_var.get() else aggregates.get_summary(user)
+        if summary:
+            avg_focus, avg_cog = summary["avg_focus"], summary["avg_cognitive"]
+            avg_sleep, avg_screen = summary["avg_sleep"], summary["avg_screen"]
+        else:
+            avg_focus = df_num["Focus"].mean()
+            avg_cog = df_num["Cognitive Score"].mean()
+            avg_sleep = df_num["Sleep Hours"].mean()
+            avg_screen = df_num["Screen Time"].mean()
         self.avg_focus_card.config(text=f"{avg_focus:.2f}" if pd.notna(avg_focus) else "-")
         self.avg_cog_card.config(text=f"{avg_cog:.2f}" if pd.notna(avg_cog) else "-")
         self.avg_sleep_card.config(text=f"{avg_sleep:.2f}h" if pd.notna(avg_sleep) else "-")
         self.avg_screen_card.config(text=f"{avg_screen:.2f}h" if pd.notna(avg_screen) else "-")
-        if not df_num["Cognitive Score"].dropna().empty:
+        if summary:
+            best_day = summary["best_day"]
+            self.best_day_card.config(text=f"{best_day} ({summary['best_cognitive']})" if best_day else "-")
+        elif not df_num["Cognitive Score"].dropna().empty:
             idx = df_num["Cognitive Score"].idxmax()
             best = df_num.loc[idx]
             self.best_day_card.config(text=f"{best['Date']} ({best['Cognitive Score']})")
@@ -419,7 +578,7 @@ class ADHDApp:
             self.best_day_card.config(text="-")
 
         # draw charts (focus by default)
-        fig = figure_focus_trend(df)
+        fig = figure_focus_trend(df) if self.use_range_var.get() else jobs.get("focus_figure", user)
         for w in self.canvas_holder.winfo_children(): w.destroy()
         canvas = FigureCanvasTkAgg(fig, master=self.canvas_holder)
         canvas.draw()
@@ -432,13 +591,17 @@ class ADHDApp:
     def refresh_insights(self):
         user = self.user_var.get() or None
         if user:
-            df = query_entries(user=user)  # full history
+            found = jobs.get("insights", user)  # full history
+            ins, advice = found["insights"], found["advice"]
         else:
-            df = None
-        ins = generate_insights(df, days=7)
+            ins, advice = generate_insights(None, days=7), []
         self.insights_box.delete("1.0", "end")
         for i in ins:
             self.insights_box.insert("end", "- " + i + "\n")
+        if advice:
+            self.insights_box.insert("end", "\nSuggestions:\n")
+            for a in advice:
+                self.insights_box.insert("end", "- " + a + "\n")
 
     def refresh_habits(self):
         user = self.user_var.get() or self.name_e.get().strip()
@@ -456,7 +619,10 @@ class ADHDApp:
 def main():
     root = tk.Tk()
     app = ADHDApp(root)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        app.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,147 @@
+# backtest.py
+"""Walk-forward backtests of candidate next-day focus models.
+
+For every user, each candidate is fit on an expanding window of that
+user's feature rows and asked to predict the following day(s); errors and
+fit/predict timings are collected and summarised per model. Users are
+spread across a process pool.
+
+    python backtest.py --models linear ridge persistence --workers 4
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+import features
+from features import FEATURE_COLS, TARGET_COL
+
+MIN_TRAIN = 5  # same minimum as ml_predict.train_user_model
+
+
+class ColumnBaseline:
+    """Predicts a feature column as-is, e.g. today's focus for tomorrow."""
+
+    def __init__(self, column):
+        self.column = column
+
+    def fit(self, X, y):
+        return self
+
+    def predict(self, X):
+        return X[self.column].to_numpy(dtype=float)
+
+
+def _scaled(model):
+    return Pipeline([("scaler", StandardScaler()), ("model", model)])
+
+# name -> factory; factories (not instances) so workers build fresh models
+CANDIDATES = {
+    "persistence": lambda: ColumnBaseline("focus"),
+    "mean7": lambda: ColumnBaseline("focus_mean7"),
+    "linear": lambda: _scaled(LinearRegression()),
+    "ridge": lambda: _scaled(Ridge(alpha=1.0)),
+    "random_forest": lambda: RandomForestRegressor(n_estimators=100, max_depth=5, random_state=0),
+    "gbr": lambda: GradientBoostingRegressor(n_estimators=100, max_depth=2, random_state=0),
+}
+
+
+def _backtest_user(args):
+    user, feats, model_names, min_train, step = args
+    df = feats.dropna(subset=FEATURE_COLS + [TARGET_COL]).reset_index(drop=True)
+    X = df[FEATURE_COLS].astype(float)
+    y = df[TARGET_COL].astype(float).to_numpy()
+    rows = []
+    for name in model_names:
+        errors, fit_s, pred_s, fits = [], 0.0, 0.0, 0
+        for t in range(min_train, len(df), step):
+            model = CANDIDATES[name]()
+            t0 = time.perf_counter()
+            model.fit(X.iloc[:t], y[:t])
+            t1 = time.perf_counter()
+            pred = model.predict(X.iloc[t:t + step])
+            t2 = time.perf_counter()
+            fit_s += t1 - t0
+            pred_s += t2 - t1
+            fits += 1
+            errors.extend(pred - y[t:t + step])
+        err = np.asarray(errors, dtype=float)
+        rows.append({
+            "user": user,
+            "model": name,
+            "n_pred": len(err),
+            "mae": float(np.abs(err).mean()) if len(err) else np.nan,
+            "rmse": float(np.sqrt((err ** 2).mean())) if len(err) else np.nan,
+            "sse": float((err ** 2).sum()),
+            "abs_err": float(np.abs(err).sum()),
+            "fit_ms": fit_s * 1000 / fits if fits else np.nan,
+            "predict_ms": pred_s * 1000 / fits if fits else np.nan,
+        })
+    return rows
+
+
+def run_backtest(model_names=None, users=None, min_train=MIN_TRAIN, step=1, workers=None):
+    """Returns (per_user, summary) DataFrames. step > 1 refits every `step` days."""
+    model_names = list(model_names or CANDIDATES)
+    unknown = [m for m in model_names if m not in CANDIDATES]
+    if unknown:
+        raise ValueError(f"unknown models: {', '.join(unknown)}")
+    features.update_features()
+    feats = features.load_features()
+    if users:
+        feats = feats[feats["user"].isin(users)]
+    jobs = [(u, part, model_names, min_train, step) for u, part in feats.groupby("user", sort=False)]
+
+    rows = []
+    if workers == 1:
+        for job in jobs:
+            rows.extend(_backtest_user(job))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for part in ex.map(_backtest_user, jobs, chunksize=max(1, len(jobs) // 64)):
+                rows.extend(part)
+    per_user = pd.DataFrame(rows)
+    if per_user.empty:
+        return per_user, per_user
+
+    # pool errors over all predictions rather than averaging per-user scores
+    scored = per_user[per_user["n_pred"] > 0]
+    g = scored.groupby("model")
+    summary = pd.DataFrame({
+        "users": g["user"].nunique(),
+        "n_pred": g["n_pred"].sum(),
+        "mae": g["abs_err"].sum() / g["n_pred"].sum(),
+        "rmse": np.sqrt(g["sse"].sum() / g["n_pred"].sum()),
+        "fit_ms": g["fit_ms"].mean(),
+        "predict_ms": g["predict_ms"].mean(),
+    }).sort_values("mae")
+    return per_user.drop(columns=["sse", "abs_err"]), summary
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Walk-forward backtest of next-day focus models")
+    ap.add_argument("--models", nargs="*", default=None, help=f"subset of: {', '.join(CANDIDATES)}")
+    ap.add_argument("--users", nargs="*", default=None)
+    ap.add_argument("--min-train", type=int, default=MIN_TRAIN)
+    ap.add_argument("--step", type=int, default=1)
+    ap.add_argument("--workers", type=int, default=None)
+    ap.add_argument("--out", default=None, help="optional CSV path for per-user results")
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    per_user, summary = run_backtest(args.models, args.users, args.min_train, args.step, args.workers)
+    if summary.empty:
+        print("Not enough data to backtest.")
+        return
+    print(summary.round(3).to_string())
+    print(f"\n{per_user['user'].nunique()} users in {time.perf_counter() - t0:.1f}s")
+    if args.out:
+        per_user.to_csv(args.out, index=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# entry_matrix.py
+"""Numeric entry columns of every user in memory-mapped NumPy arrays.
+
+    m = open_matrix()                 # sync, then map read-only
+    dates, values = m.rows("alice")   # views into the map, no copy
+    values[:, m.col("focus")]
+
+Layout under MATRIX_DIR, per generation g:
+
+    values.g.bin   float32 (capacity, len(COLUMNS)); NULL is NaN
+    dates.g.bin    int64 day numbers, readable as datetime64[D]
+    ids.g.bin      int64 entry id (per shard in sharded mode)
+    index.json     user -> [offset, length, capacity], per-shard high-water marks
+
+Each user owns one contiguous block sorted by (date, id), so a user's rows
+are a slice found with one dict lookup. sync() appends entries written
+since the last call into the free space at the end of a block. A full
+block, or one that receives a backdated row, is copied to the end of the
+file with twice the room. Written rows are never changed in place, so a
+reader holding an older index still sees consistent data. When rows
+disappear (retention.py compaction) the matrix is rebuilt into a new
+generation, and so is a file that is mostly abandoned blocks. Only raw
+entries are stored; rolled-up periods are not.
+
+One process should sync a given MATRIX_DIR; any number may read it.
+"""
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+
+import storage_sql
+from storage_sql import Entry
+
+MATRIX_DIR = os.path.join("cache", "entry_matrix")
+COLUMNS = ("focus", "hyperactivity", "impulsivity", "sleep_hours", "distractions",
+           "tasks_completed", "cognitive_score", "screen_time")
+VERSION = 1
+MIN_BLOCK = 16
+FETCH_BATCH = 5000
+GARBAGE_RATIO = 0.5  # rebuild once abandoned blocks exceed this share of the file
+
+_ARRAYS = {"values": (np.float32, len(COLUMNS)), "dates": (np.int64, 1), "ids": (np.int64, 1)}
+_lock = threading.Lock()
+
+# ---- files ----
+
+def _index_path(matrix_dir):
+    return os.path.join(matrix_dir, "index.json")
+
+def _path(matrix_dir, name, gen):
+    return os.path.join(matrix_dir, f"{name}.{gen}.bin")
+
+def _load_index(matrix_dir):
+    try:
+        with open(_index_path(matrix_dir)) as f:
+            idx = json.load(f)
+    except FileNotFoundError:
+        return None
+    return idx if idx.get("version") == VERSION and idx.get("columns") == list(COLUMNS) else None
+
+def _save_index(matrix_dir, idx):
+    tmp = _index_path(matrix_dir) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(idx, f)
+    os.replace(tmp, _index_path(matrix_dir))
+
+def _map(matrix_dir, idx, mode):
+    maps = {}
+    for name, (dtype, width) in _ARRAYS.items():
+        shape = (idx["capacity"], width) if width > 1 else (idx["capacity"],)
+        maps[name] = np.memmap(_path(matrix_dir, name, idx["gen"]), dtype=dtype, mode=mode, shape=shape)
+    return maps
+
+def _grow(matrix_dir, idx, maps, rows):
+    """Make room for rows rows in total; returns the (re)opened maps."""
+    if rows <= idx["capacity"]:
+        return maps
+    for m in maps.values():
+        m.flush()
+    capacity = max(rows, 2 * idx["capacity"], 1024)
+    for name, (dtype, width) in _ARRAYS.items():
+        path = _path(matrix_dir, name, idx["gen"])
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            f.truncate(capacity * width * np.dtype(dtype).itemsize)
+    idx["capacity"] = capacity
+    return _map(matrix_dir, idx, "r+")
+
+def _drop_other_generations(matrix_dir, gen):
+    for path in glob.glob(os.path.join(matrix_dir, "*.bin")):
+        if not path.endswith(f".{gen}.bin"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # still mapped by a reader (Windows); removed on a later rebuild
+
+# ---- reading entries ----
+
+def _shard_marks(factory, upto):
+    # (max id, count of rows with id <= upto): the count drops when rows were deleted
+    session = factory()
+    try:
+        max_id = session.query(func.max(Entry.id)).scalar() or 0
+        seen = session.query(func.count(Entry.id)).filter(Entry.id <= upto).scalar() if upto else 0
+        return max_id, seen
+    finally:
+        session.close()
+
+def _fetch(factory, after, batch=FETCH_BATCH):
+    cols = [Entry.id, Entry.user, Entry.entry_date] + [getattr(Entry, c) for c in COLUMNS]
+    while True:
+        session = factory()
+        try:
+            rows = session.query(*cols).filter(Entry.id > after).order_by(Entry.id).limit(batch).all()
+        finally:
+            session.close()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+def _to_arrays(rows):
+    """Rows with a user and date -> {user: (ids, days, values)}, each sorted by (date, id)."""
+    rows = [r for r in rows if r[1] is not None and r[2] is not None]
+    if not rows:
+        return {}
+    codes, users = pd.factorize(pd.Series([r[1] for r in rows]))
+    ids = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    days = np.array([storage_sql._fix_date(r[2]) for r in rows], dtype="datetime64[D]").astype(np.int64)
+    values = np.array([[np.nan if v is None else v for v in r[3:]] for r in rows], dtype=np.float32)
+    order = np.lexsort((ids, days, codes))
+    bounds = np.flatnonzero(np.diff(codes[order])) + 1
+    out = {}
+    for sel in np.split(order, bounds):
+        out[users[codes[sel[0]]]] = (ids[sel], days[sel], values[sel])
+    return out
+
+# ---- writing ----
+
+def _append(matrix_dir, idx, maps, user, ids, days, values):
+    block = idx["users"].get(user)
+    off, n, cap = block if block else (0, 0, 0)
+    k = len(ids)
+    backdated = n and days[0] < maps["dates"][off + n - 1]
+    if block and n + k <= cap and not backdated:
+        start = off + n
+        maps["values"][start:start + k] = values
+        maps["dates"][start:start + k] = days
+        maps["ids"][start:start + k] = ids
+        block[1] = n + k
+        return maps
+    # move the block to the end with room to grow
+    new_cap = max(MIN_BLOCK, 2 * (n + k))
+    new_off = idx["used"]
+    maps = _grow(matrix_dir, idx, maps, new_off + new_cap)
+    all_ids = np.concatenate([maps["ids"][off:off + n], ids])
+    all_days = np.concatenate([maps["dates"][off:off + n], days])
+    all_values = np.concatenate([maps["values"][off:off + n], values])
+    order = np.lexsort((all_ids, all_days)) if backdated else slice(None)
+    maps["values"][new_off:new_off + n + k] = all_values[order]
+    maps["dates"][new_off:new_off + n + k] = all_days[order]
+    maps["ids"][new_off:new_off + n + k] = all_ids[order]
+    idx["users"][user] = [new_off, n + k, new_cap]
+    idx["used"] = new_off + new_cap
+    idx["garbage"] += cap
+    return maps
+
+def _new_index(gen, shards):
+    return {"version": VERSION, "columns": list(COLUMNS), "gen": gen, "capacity": 0, "used": 0,
+            "garbage": 0, "users": {}, "shards": [{"last_id": 0, "count": 0} for _ in range(shards)]}
+
+def _compact(matrix_dir, idx, maps):
+    """Copy every block into a fresh generation, dropping abandoned blocks; returns the new index."""
+    new = _new_index(idx["gen"] + 1, len(idx["shards"]))
+    new["shards"] = idx["shards"]
+    new_maps = {}
+    for user, (off, n, _) in sorted(idx["users"].items(), key=lambda kv: kv[1][0]):
+        new_maps = _append(matrix_dir, new, new_maps or _grow(matrix_dir, new, {}, 1), user,
+                           np.array(maps["ids"][off:off + n]), np.array(maps["dates"][off:off + n]),
+                           np.array(maps["values"][off:off + n]))
+    new["garbage"] = 0
+    for m in new_maps.values():
+        m.flush()
+    return new
+
+def sync(matrix_dir=MATRIX_DIR, rebuild=False):
+    """Append entries written since the last sync; returns the number of rows added.
+
+    Rebuilds from scratch when rows were deleted, the shard layout changed
+    or rebuild is set.
+    """
+    with _lock:
+        os.makedirs(matrix_dir, exist_ok=True)
+        factories = storage_sql.all_session_factories()
+        on_disk = _load_index(matrix_dir)
+        idx = None if rebuild else on_disk
+        if idx is not None and len(idx["shards"]) == len(factories):
+            last = {f: s["last_id"] for f, s in zip(factories, idx["shards"])}
+            marks = storage_sql.fan_out(lambda f: _shard_marks(f, last[f]))
+            if any(seen != s["count"] for (_, seen), s in zip(marks, idx["shards"])):
+                idx = None
+        else:
+            idx = None
+        if idx is None:
+            idx = _new_index(on_disk["gen"] + 1 if on_disk else 0, len(factories))
+            marks = [(None, 0)] * len(factories)
+        elif all(max_id <= s["last_id"] for (max_id, _), s in zip(marks, idx["shards"])):
+            return 0
+        maps = _map(matrix_dir, idx, "r+") if idx["capacity"] else {}
+        added = 0
+        for factory, state in zip(factories, idx["shards"]):
+            for rows in _fetch(factory, state["last_id"]):
+                for user, (ids, days, values) in _to_arrays(rows).items():
+                    maps = _append(matrix_dir, idx, maps or _grow(matrix_dir, idx, {}, 1), user, ids, days, values)
+                    added += len(ids)
+                state["last_id"] = rows[-1][0]
+                state["count"] += len(rows)
+        if maps and idx["garbage"] > GARBAGE_RATIO * idx["used"]:
+            idx = _compact(matrix_dir, idx, maps)
+        for m in maps.values():
+            m.flush()
+        _save_index(matrix_dir, idx)
+        if on_disk is None or on_disk["gen"] != idx["gen"]:
+            _drop_other_generations(matrix_dir, idx["gen"])
+        return added
+
+# ---- reading ----
+
+class EntryMatrix:
+    """Read-only map of the matrix as of the last sync.
+
+    users/offsets/lengths are parallel arrays; rows() returns views into the
+    map, so they cost no copy and stay valid while this object lives.
+    """
+
+    def __init__(self, matrix_dir=MATRIX_DIR):
+        idx = _load_index(matrix_dir)
+        if idx is None:
+            raise FileNotFoundError(f"no entry matrix in {matrix_dir}; run sync() first")
+        self.columns = list(COLUMNS)
+        self.users = sorted(idx["users"])
+        self.offsets = np.array([idx["users"][u][0] for u in self.users], dtype=np.int64)
+        self.lengths = np.array([idx["users"][u][1] for u in self.users], dtype=np.int64)
+        self._pos = {u: i for i, u in enumerate(self.users)}
+        if idx["capacity"]:
+            maps = _map(matrix_dir, idx, "r")
+            self.values, self.dates, self.ids = maps["values"], maps["dates"], maps["ids"]
+        else:
+            self.values = np.empty((0, len(COLUMNS)), dtype=np.float32)
+            self.dates = np.empty(0, dtype=np.int64)
+            self.ids = np.empty(0, dtype=np.int64)
+
+    def __contains__(self, user):
+        return user in self._pos
+
+    def __len__(self):
+        return int(self.lengths.sum())
+
+    def col(self, name):
+        return self.columns.index(name)
+
+    def span(self, user):
+        """(offset, length) of the user's block; (0, 0) for an unknown user."""
+        i = self._pos.get(user)
+        return (int(self.offsets[i]), int(self.lengths[i])) if i is not None else (0, 0)
+
+    def rows(self, user):
+        """(dates as datetime64[D], float32 values) for one user, oldest first."""
+        off, n = self.span(user)
+        return self.dates[off:off + n].view("datetime64[D]"), self.values[off:off + n]
+
+    def frame(self, user):
+        """One user's rows as a DataFrame (copies; for pandas code)."""
+        dates, values = self.rows(user)
+        df = pd.DataFrame(np.array(values), columns=self.columns)
+        df.insert(0, "date", np.array(dates))
+        return df
+
+def open_matrix(matrix_dir=MATRIX_DIR, sync_first=True):
+    if sync_first:
+        sync(matrix_dir)
+    return EntryMatrix(matrix_dir)
+
+def main():
+    import argparse
+    import time
+    ap = argparse.ArgumentParser(description="Build or update the memory-mapped entry matrix")
+    ap.add_argument("--dir", default=MATRIX_DIR)
+    ap.add_argument("--rebuild", action="store_true")
+    args = ap.parse_args()
+    storage_sql.init_db()
+    t0 = time.perf_counter()
+    added = sync(args.dir, rebuild=args.rebuild)
+    m = EntryMatrix(args.dir)
+    print(f"{added} rows added in {time.perf_counter() - t0:.2f}s; {len(m)} rows for {len(m.users)} users in {args.dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# events.py
+"""In-process change-event bus fed by storage_sql writes.
+
+Every committed add_entry/add_habit (single or batched) publishes a list
+of storage_sql.ChangeEvent(seq, table, op, user, date, row_id). Delivery
+happens on a dispatcher thread so consumers never slow down a write.
+
+Consumers subscribe by name. A durable consumer keeps its position in
+consumer_offsets; when the change log is enabled it reads new rows from
+change_log instead of taking events straight from the bus, so it also
+sees writes from other processes and can catch up after a restart. With
+the change log off, every consumer gets live events only. Set
+ADHD_CHANGE_LOG=1 to turn it on (storage_sql.init_db); trim() drops the
+rows every consumer has read.
+"""
+import logging
+import queue
+import threading
+
+from sqlalchemy import Column, Integer, String, func
+
+import storage_sql
+from storage_sql import Base, ChangeEvent, ChangeLog
+
+log = logging.getLogger(__name__)
+
+CATCH_UP_BATCH = 500
+
+class ConsumerOffset(Base):
+    __tablename__ = "consumer_offsets"
+    consumer = Column(String, primary_key=True)
+    last_seq = Column(Integer, default=0)
+
+class _Subscription:
+    __slots__ = ("name", "callback", "tables", "durable")
+
+    def __init__(self, name, callback, tables, durable):
+        self.name = name
+        self.callback = callback
+        self.tables = tuple(tables) if tables else None
+        self.durable = durable
+
+    def wants(self, event):
+        return self.tables is None or event.table in self.tables
+
+class EventBus:
+    def __init__(self):
+        self._subs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.RLock()  # one delivery at a time, in commit order
+        self._thread = None
+
+    def subscribe(self, name, callback, tables=None, durable=False):
+        """callback(events) receives a list of ChangeEvent; tables limits which tables it sees."""
+        with self._lock:
+            self._subs[name] = _Subscription(name, callback, tables, durable)
+
+    def unsubscribe(self, name):
+        with self._lock:
+            self._subs.pop(name, None)
+
+    def publish(self, events):
+        if not events or not self._subs:
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="change-events", daemon=True)
+                    self._thread.start()
+        self._queue.put(list(events))
+
+    def flush(self):
+        """Block until every published event has been delivered."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            events = self._queue.get()
+            try:
+                self._dispatch(events)
+            finally:
+                self._queue.task_done()
+
+    def _dispatch(self, events):
+        logged = storage_sql.CHANGE_LOG and events[0].seq is not None
+        with self._lock:
+            subs = list(self._subs.values())
+        for sub in subs:
+            try:
+                if sub.durable and logged:
+                    self.catch_up(sub.name)
+                else:
+                    mine = [e for e in events if sub.wants(e)]
+                    if mine:
+                        with self._lock:
+                            sub.callback(mine)
+            except Exception:
+                log.exception("change consumer %s failed", sub.name)
+
+    # ---- offsets (only meaningful with the change log enabled) ----
+    # In sharded mode every shard has its own change_log and consumer_offsets,
+    # so a consumer keeps one offset per shard.
+
+    def _session(self, factory):
+        ConsumerOffset.__table__.create(bind=factory.kw["bind"], checkfirst=True)
+        return factory()
+
+    def get_offset(self, name, shard=0):
+        session = self._session(storage_sql.all_session_factories()[shard])
+        try:
+            row = session.get(ConsumerOffset, name)
+            return row.last_seq if row else 0
+        finally:
+            session.close()
+
+    def _set_offset(self, session, name, seq):
+        row = session.get(ConsumerOffset, name)
+        if row is None:
+            session.add(ConsumerOffset(consumer=name, last_seq=seq))
+        else:
+            row.last_seq = seq
+        session.commit()
+
+    def seek_to_end(self, name):
+        """Skip history, e.g. for a view that is rebuilt from scratch on start."""
+        if not storage_sql.CHANGE_LOG:
+            return []
+        seqs = []
+        for factory in storage_sql.all_session_factories():
+            session = self._session(factory)
+            try:
+                seq = session.query(func.max(ChangeLog.seq)).scalar() or 0
+                self._set_offset(session, name, seq)
+                seqs.append(seq)
+            finally:
+                session.close()
+        return seqs
+
+    def forget(self, name):
+        """Unsubscribe and delete the consumer's offsets, e.g. a per-process consumer on shutdown."""
+        self.unsubscribe(name)
+        if not storage_sql.CHANGE_LOG:
+            return
+        for factory in storage_sql.all_session_factories():
+            session = self._session(factory)
+            try:
+                session.query(ConsumerOffset).filter(ConsumerOffset.consumer==name).delete()
+                session.commit()
+            finally:
+                session.close()
+
+    def trim(self):
+        """Delete change_log rows every consumer has read; returns how many were deleted.
+
+        A consumer with an offset on some shard but not on another counts as
+        unread there, and nothing is trimmed while no consumer has an offset.
+        """
+        if not storage_sql.CHANGE_LOG:
+            return 0
+        factories = storage_sql.all_session_factories()
+        offsets = []
+        for factory in factories:
+            session = self._session(factory)
+            try:
+                offsets.append(dict(session.query(ConsumerOffset.consumer, ConsumerOffset.last_seq)))
+            finally:
+                session.close()
+        names = set().union(*offsets)
+        deleted = 0
+        for factory, seen in zip(factories, offsets):
+            if not names or names - set(seen):
+                continue
+            session = factory()
+            try:
+                deleted += session.query(ChangeLog).filter(ChangeLog.seq <= min(seen.values())).delete()
+                session.commit()
+            finally:
+                session.close()
+        return deleted
+
+    def catch_up_all(self):
+        """catch_up every durable consumer; returns how many events were delivered."""
+        with self._lock:
+            names = [s.name for s in self._subs.values() if s.durable]
+        return sum(self.catch_up(name) for name in names)
+
+    def catch_up(self, name, batch_size=CATCH_UP_BATCH):
+        """Deliver change_log rows past the consumer's offset(s); returns how many were delivered."""
+        if not storage_sql.CHANGE_LOG:
+            return 0
+        with self._lock:
+            sub = self._subs.get(name)
+            if sub is None:
+                return 0
+            return sum(self._catch_up_shard(sub, factory, batch_size)
+                       for factory in storage_sql.all_session_factories())
+
+    def _catch_up_shard(self, sub, factory, batch_size):
+        delivered = 0
+        session = self._session(factory)
+        try:
+            row = session.get(ConsumerOffset, sub.name)
+            offset = row.last_seq if row else 0
+            while True:
+                q = session.query(ChangeLog).filter(ChangeLog.seq > offset)
+                if sub.tables:
+                    q = q.filter(ChangeLog.table_name.in_(sub.tables))
+                rows = q.order_by(ChangeLog.seq).limit(batch_size).all()
+                if not rows:
+                    break
+                batch = [ChangeEvent(r.seq, r.table_name, r.op, r.user, r.date, r.row_id) for r in rows]
+                sub.callback(batch)
+                # at-least-once: the offset moves only after the callback returned
+                offset = batch[-1].seq
+                self._set_offset(session, sub.name, offset)
+                delivered += len(batch)
+                if len(rows) < batch_size:
+                    break
+        finally:
+            session.close()
+        return delivered
+
+bus = EventBus()
+subscribe = bus.subscribe
+unsubscribe = bus.unsubscribe
+catch_up = bus.catch_up
+catch_up_all = bus.catch_up_all
+trim = bus.trim
+seek_to_end = bus.seek_to_end
+forget = bus.forget
+flush = bus.flush
+
+storage_sql.on_write(bus.publish)
@@ -0,0 +1,214 @@
+# features.py
+"""Per-user daily time-series features for next-day focus forecasting.
+
+Entries are collapsed to one row per (user, day), then calendar-day lags,
+rolling mean/std over 3/7/14 days and day-of-week are computed for all
+users in one groupby pass. Results live in the entry_features table and
+are maintained incrementally: feature_state remembers the last entry id
+seen per user, and only days on or after the earliest new entry are
+recomputed (with a 14-day lookback for context). In sharded mode both
+tables live on each shard next to that shard's entries.
+"""
+import threading
+from datetime import timedelta
+
+import pandas as pd
+from sqlalchemy import Column, Integer, String, select, text
+
+import storage_sql
+from storage_sql import Base, Entry
+
+FEATURE_TABLE = "entry_features"
+BASE_COLS = [
+    "focus", "hyperactivity", "impulsivity", "sleep_hours",
+    "distractions", "tasks_completed", "screen_time", "cognitive_score"
+]
+ROLLING_COLS = ["focus", "sleep_hours", "screen_time", "cognitive_score"]
+LAGS = (1, 2, 3)
+WINDOWS = (3, 7, 14)
+LOOKBACK_DAYS = max(max(WINDOWS), max(LAGS))
+TARGET_COL = "target_focus"
+
+# one update per shard at a time: two would both create the tables and append the same days
+_shard_locks = {}
+
+FEATURE_COLS = (
+    BASE_COLS
+    + [f"{c}_lag{k}" for c in ROLLING_COLS for k in LAGS]
+    + [f"{c}_{stat}{w}" for c in ROLLING_COLS for w in WINDOWS for stat in ("mean", "std")]
+    + ["dow_next"]
+)
+
+class FeatureState(Base):
+    __tablename__ = "feature_state"
+    user = Column(String, primary_key=True)
+    last_entry_id = Column(Integer, default=0)
+
+def _ensure_tables(engine):
+    FeatureState.__table__.create(bind=engine, checkfirst=True)
+
+def _has_feature_table(conn):
+    # entry_features is created by to_sql on the first update that has data
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"), {"n": FEATURE_TABLE}).first() is not None
+
+def _empty_features():
+    return pd.DataFrame(columns=["user", "date"] + FEATURE_COLS)
+
+def _daily(raw):
+    # several entries on one day are averaged into a single observation
+    d = raw.copy()
+    d["date"] = pd.to_datetime(d["date"])
+    for c in BASE_COLS:
+        d[c] = pd.to_numeric(d[c], errors="coerce")
+    return d.groupby(["user", "date"], as_index=False)[BASE_COLS].mean().sort_values(["user", "date"])
+
+def compute_features(raw):
+    """raw: columns user, date + BASE_COLS (any number of users). Returns one row per user-day."""
+    if raw is None or raw.empty:
+        return _empty_features()
+    daily = _daily(raw).reset_index(drop=True)
+    out = daily.copy()
+
+    # calendar-day lags: value logged exactly k days earlier, via a shifted self-join
+    for k in LAGS:
+        shifted = daily[["user", "date"] + ROLLING_COLS].copy()
+        shifted["date"] = shifted["date"] + pd.Timedelta(days=k)
+        shifted.columns = ["user", "date"] + [f"{c}_lag{k}" for c in ROLLING_COLS]
+        out = out.merge(shifted, on=["user", "date"], how="left")
+
+    g = daily.set_index("date").groupby("user")[ROLLING_COLS]
+    for w in WINDOWS:
+        roll = g.rolling(f"{w}D", min_periods=1)
+        mean = roll.mean().reset_index(drop=True)
+        std = roll.std().reset_index(drop=True)
+        for c in ROLLING_COLS:
+            out[f"{c}_mean{w}"] = mean[c].values
+            out[f"{c}_std{w}"] = std[c].fillna(0.0).values
+
+    # days without a log get the 7-day mean, so sparse loggers still get a usable row
+    for c in ROLLING_COLS:
+        for k in LAGS:
+            col = f"{c}_lag{k}"
+            out[col] = out[col].fillna(out[f"{c}_mean7"])
+    out["dow_next"] = (out["date"] + pd.Timedelta(days=1)).dt.dayofweek
+    return out[["user", "date"] + FEATURE_COLS]
+
+def _load_raw(engine, since_by_user):
+    users = list(since_by_user)
+    earliest = min(since_by_user.values()) - timedelta(days=LOOKBACK_DAYS)
+    stmt = select(
+        Entry.user.label("user"), Entry.entry_date.label("date"), *[getattr(Entry, c) for c in BASE_COLS]
+    ).where(Entry.user.in_(users), Entry.entry_date >= earliest)
+    raw = pd.read_sql(stmt, engine)
+    if raw.empty:
+        return raw
+    # trim to each user's own lookback window
+    raw["date"] = pd.to_datetime(raw["date"])
+    start = raw["user"].map({u: pd.Timestamp(d) - pd.Timedelta(days=LOOKBACK_DAYS) for u, d in since_by_user.items()})
+    return raw[raw["date"] >= start]
+
+def _pending(engine):
+    # per user: earliest day touched by unseen entries and the newest entry id
+    sql = text(
+        "SELECT e.user AS user, MIN(e.entry_date) AS since, MAX(e.id) AS max_id "
+        "FROM entries e LEFT JOIN feature_state s ON s.user = e.user "
+        "WHERE e.id > COALESCE(s.last_entry_id, 0) AND e.user IS NOT NULL AND e.entry_date IS NOT NULL "
+        "GROUP BY e.user"
+    )
+    with engine.connect() as conn:
+        return conn.execute(sql).fetchall()
+
+def update_features(users=None):
+    """Bring entry_features up to date; returns the number of user-days (re)written."""
+    wanted = None
+    engines = storage_sql.all_engines()
+    if users is not None:
+        wanted = set([users] if isinstance(users, str) else users)
+        engines = list(dict.fromkeys(storage_sql.engine_for(u) for u in wanted))
+    return sum(storage_sql.fan_out(lambda engine: _update_shard(engine, wanted), engines))
+
+def _update_shard(engine, wanted):
+    with _shard_locks.setdefault(engine, threading.Lock()):
+        return _update_locked(engine, wanted)
+
+def _update_locked(engine, wanted):
+    _ensure_tables(engine)
+    pending = _pending(engine)
+    if wanted is not None:
+        pending = [p for p in pending if p.user in wanted]
+    if not pending:
+        return 0
+    since_by_user = {p.user: pd.Timestamp(p.since).date() for p in pending}
+    feats = compute_features(_load_raw(engine, since_by_user))
+    if not feats.empty:
+        since = feats["user"].map({u: pd.Timestamp(d) for u, d in since_by_user.items()})
+        feats = feats[feats["date"] >= since].copy()
+        feats["date"] = feats["date"].dt.strftime("%Y-%m-%d")
+
+    with engine.begin() as conn:
+        has_table = _has_feature_table(conn)
+        if has_table:
+            conn.execute(
+                text(f"DELETE FROM {FEATURE_TABLE} WHERE user = :u AND date >= :d"),
+                [{"u": u, "d": d.isoformat()} for u, d in since_by_user.items()]
+            )
+        if not feats.empty:
+            feats.to_sql(FEATURE_TABLE, conn, if_exists="append", index=False)
+            if not has_table:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{FEATURE_TABLE}_user_date ON {FEATURE_TABLE} (user, date)"))
+        conn.execute(
+            text("INSERT OR REPLACE INTO feature_state (user, last_entry_id) VALUES (:u, :i)"),
+            [{"u": p.user, "i": p.max_id} for p in pending]
+        )
+    return len(feats)
+
+def _with_target(feats):
+    # target is the focus of the user's next logged day
+    if feats.empty:
+        feats[TARGET_COL] = pd.Series(dtype=float)
+        return feats
+    feats = feats.sort_values(["user", "date"])
+    feats[TARGET_COL] = feats.groupby("user")["focus"].shift(-1)
+    return feats
+
+def _read_features(engine, user):
+    sql = f"SELECT * FROM {FEATURE_TABLE}"
+    params = {}
+    if user:
+        sql += " WHERE user = :u"
+        params["u"] = user
+    sql += " ORDER BY user, date"
+    with engine.connect() as conn:
+        if not _has_feature_table(conn):
+            return _empty_features()
+        return pd.read_sql(text(sql), conn, params=params)
+
+def load_features(user=None):
+    """Feature rows (plus target_focus) ordered by user, date. The newest row per user has no target."""
+    if user:
+        return _with_target(_read_features(storage_sql.engine_for(user), user))
+    parts = storage_sql.fan_out(lambda engine: _read_features(engine, None), storage_sql.all_engines())
+    parts = [p for p in parts if not p.empty]
+    return _with_target(pd.concat(parts, ignore_index=True) if parts else _empty_features())
+
+def iter_features(chunk_size=storage_sql.ITER_CHUNK_SIZE):
+    """Stream feature rows for all users; each yielded frame holds complete users only."""
+    for engine in storage_sql.all_engines():
+        yield from _iter_shard_features(engine, chunk_size)
+
+def _iter_shard_features(engine, chunk_size):
+    with engine.connect() as conn:
+        if not _has_feature_table(conn):
+            return
+    pending = None
+    for chunk in pd.read_sql(text(f"SELECT * FROM {FEATURE_TABLE} ORDER BY user, date"),
+                             engine, chunksize=chunk_size):
+        buf = chunk if pending is None else pd.concat([pending, chunk], ignore_index=True)
+        last_user = buf["user"].iloc[-1]
+        done = buf[buf["user"] != last_user]
+        pending = buf[buf["user"] == last_user]
+        if not done.empty:
+            yield _with_target(done.copy())
+    if pending is not None and not pending.empty:
+        yield _with_target(pending.copy())
@@ -0,0 +1,243 @@
+# jobs.py
+"""Periodic warm-up jobs, so the first dashboard click of the day is served from warm state.
+
+    schedule(app.scheduler)    # in the app, on its BackgroundScheduler
+    python jobs.py             # headless, on a BlockingScheduler
+
+Jobs work on recently active users (an entry in the last ACTIVE_DAYS days):
+
+    warm_queries         full-history entries and the summary cards
+    refresh_models       retrain models deleted as stale, cache the next-day prediction
+    precompute_insights  insights and advice from the warm entries
+    render_charts        full-history focus trend figure and the overview sparklines
+    compact              retention rollups (only when ADHD_RETENTION_MONTHS is set),
+                         then drop change_log rows every consumer has read
+    sync_matrix          append new entries to the memory-mapped entry matrix
+    catch_up_changes     deliver other processes' writes to the durable consumers
+                         (only with the change log on, ADHD_CHANGE_LOG=1)
+
+Headless with the change log on, the PDF reports in report.REPORT_DIR are
+also kept current (report.watch_reports).
+
+Results live in an in-process cache keyed by (kind, user). Each value is
+stored with the user's data watermark and rebuilt on read once that moves,
+so a stale value is never served. In headless mode only the on-disk
+results (models, feature rows, summaries, sparklines, entry matrix)
+benefit other processes.
+
+Each job has an interval, jitter, max_instances (overlapping runs) and
+workers (users warmed in parallel) in JOBS. Every run's duration goes into
+stats().
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import aggregates
+import events
+import storage_sql
+from logic import generate_insights, rule_based_advice
+
+log = logging.getLogger(__name__)
+
+ACTIVE_DAYS = 14
+START_DELAY = 5  # seconds before the first run, so startup isn't slowed down
+
+# name -> interval/jitter in seconds, max_instances, workers
+JOBS = {
+    "warm_queries": {"interval": 300, "jitter": 30, "max_instances": 1, "workers": 4},
+    "refresh_models": {"interval": 900, "jitter": 60, "max_instances": 1, "workers": 2},
+    "precompute_insights": {"interval": 300, "jitter": 30, "max_instances": 1, "workers": 4},
+    "render_charts": {"interval": 600, "jitter": 60, "max_instances": 1, "workers": 2},
+    "compact": {"interval": 86400, "jitter": 600, "max_instances": 1, "workers": 1},
+    "sync_matrix": {"interval": 120, "jitter": 15, "max_instances": 1, "workers": 1},
+    "catch_up_changes": {"interval": 30, "jitter": 5, "max_instances": 1, "workers": 1},
+}
+
+_cache = {}  # (kind, user) -> (watermark, value)
+_cache_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+# ---- warm cache ----
+
+def _entries(user):
+    return storage_sql.query_entries(user=user)
+
+def _insights(user):
+    df = get("entries", user)
+    return {"insights": generate_insights(df, days=7), "advice": rule_based_advice(df)}
+
+def _focus_figure(user):
+    from viz import figure_focus_trend
+    return figure_focus_trend(get("entries", user))
+
+def _prediction(user):
+    from ml_predict import predict_next_day
+    return predict_next_day(user)
+
+BUILDERS = {
+    "entries": _entries,
+    "insights": _insights,
+    "focus_figure": _focus_figure,
+    "prediction": _prediction,
+}
+
+def get(kind, user):
+    """BUILDERS[kind](user), served from the cache while the user's data is unchanged.
+
+    Values are shared between callers; treat them as read-only.
+    """
+    # read the watermark first: a write racing the build only makes the next call rebuild
+    wm = storage_sql.get_user_watermark(user)
+    with _cache_lock:
+        hit = _cache.get((kind, user))
+    if hit and hit[0] == wm:
+        return hit[1]
+    value = BUILDERS[kind](user)
+    with _cache_lock:
+        _cache[(kind, user)] = (wm, value)
+    return value
+
+def clear():
+    with _cache_lock:
+        _cache.clear()
+
+# ---- jobs ----
+
+def active_users(days=ACTIVE_DAYS):
+    return storage_sql.get_users(active_since=date.today() - timedelta(days=days))
+
+def _per_user(fn, workers):
+    users = active_users()
+    if workers > 1 and len(users) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(fn, users))
+    else:
+        for u in users:
+            fn(u)
+    return len(users)
+
+def warm_queries(workers=1):
+    def warm(user):
+        get("entries", user)
+        aggregates.get_summary(user)
+    return _per_user(warm, workers)
+
+def refresh_models(workers=1):
+    try:
+        import ml_predict  # noqa: F401 -- optional, like in the app
+    except Exception:
+        return 0
+    return _per_user(lambda u: get("prediction", u), workers)
+
+def precompute_insights(workers=1):
+    return _per_user(lambda u: get("insights", u), workers)
+
+def render_charts(workers=1):
+    import overview
+    n = _per_user(lambda u: get("focus_figure", u), workers)
+    overview.build_overview()
+    return n
+
+def compact(workers=1):
+    import retention
+    events.trim()
+    if retention.RETENTION_MONTHS <= 0:
+        return 0
+    totals = retention.compact()
+    clear()  # rolled-up users get new watermarks anyway; this frees their old values now
+    return sum(rows for rows, _ in totals.values())
+
+def sync_matrix(workers=1):
+    import entry_matrix
+    return entry_matrix.sync()
+
+def catch_up_changes(workers=1):
+    return events.catch_up_all()
+
+_FUNCS = {
+    "warm_queries": warm_queries,
+    "refresh_models": refresh_models,
+    "precompute_insights": precompute_insights,
+    "render_charts": render_charts,
+    "compact": compact,
+    "sync_matrix": sync_matrix,
+    "catch_up_changes": catch_up_changes,
+}
+
+def run(name):
+    """Run one job now and record its duration; returns the job's count (users or rows)."""
+    t0 = time.perf_counter()
+    error, result = None, None
+    try:
+        result = _FUNCS[name](workers=JOBS[name].get("workers", 1))
+    except Exception as e:
+        error = repr(e)
+        log.exception("job %s failed", name)
+    elapsed = time.perf_counter() - t0
+    with _stats_lock:
+        s = _stats.setdefault(name, {"runs": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        s["runs"] += 1
+        s["errors"] += error is not None
+        s["total_seconds"] += elapsed
+        s["max_seconds"] = max(s["max_seconds"], elapsed)
+        s.update(last_run=datetime.now(), last_seconds=elapsed, last_result=result, last_error=error)
+    log.info("job %s: %s in %.2fs", name, result, elapsed)
+    return result
+
+def stats():
+    """{job: runs, errors, last_run, last_seconds, mean_seconds, max_seconds, last_result, last_error}."""
+    with _stats_lock:
+        out = {}
+        for name, s in _stats.items():
+            out[name] = dict(s, mean_seconds=s["total_seconds"] / s["runs"])
+        return out
+
+def schedule(scheduler, jobs=None):
+    """Add the jobs (all of JOBS by default) to an APScheduler scheduler; returns the job ids."""
+    names = list(jobs or JOBS)
+    for i, name in enumerate(names):
+        cfg = JOBS[name]
+        # spread the first runs so they don't all hit the database together
+        first = datetime.now() + timedelta(seconds=START_DELAY + i + random.uniform(0, cfg.get("jitter", 0)))
+        scheduler.add_job(run, "interval", args=[name], id=f"jobs.{name}", name=name,
+                          seconds=cfg["interval"], jitter=cfg.get("jitter") or None,
+                          max_instances=cfg.get("max_instances", 1), coalesce=True,
+                          replace_existing=True, next_run_time=first)
+    return [f"jobs.{n}" for n in names]
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Run the warm-up jobs headless")
+    ap.add_argument("--once", action="store_true", help="run every job once and print timings")
+    ap.add_argument("jobs", nargs="*", help=f"limit to these jobs ({', '.join(JOBS)})")
+    args = ap.parse_args()
+    unknown = sorted(set(args.jobs) - set(JOBS))
+    if unknown:
+        ap.error(f"unknown job(s): {', '.join(unknown)}")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    storage_sql.init_db()
+    if storage_sql.CHANGE_LOG:
+        import report
+        report.watch_reports()
+    names = args.jobs or list(JOBS)
+    if args.once:
+        for name in names:
+            run(name)
+        for name, s in stats().items():
+            print(f"{name:20} {s['last_result']!s:>6}  {s['last_seconds']:.2f}s" + (f"  {s['last_error']}" if s["last_error"] else ""))
+        return
+    from apscheduler.schedulers.blocking import BlockingScheduler
+    scheduler = BlockingScheduler()
+    schedule(scheduler, names)
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+if __name__ == "__main__":
+    main()
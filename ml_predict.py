@@ -1,24 +1,35 @@
 # ml_predict.py
-import pandas as pd
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
 import joblib
 import os
+import events
+import features
+from features import FEATURE_COLS, TARGET_COL
+from storage_sql import ITER_CHUNK_SIZE
 
 MODEL_DIR = "models"
 os.makedirs(MODEL_DIR, exist_ok=True)
 
-FEATURE_COLS = [
-    "Focus", "Hyperactivity", "Impulsivity",
-    "Sleep Hours", "Distractions", "Tasks Completed",
-    "Screen Time", "Cognitive Score"
-]
-TARGET_COL = "Focus"
+def _model_path(user):
+    return os.path.join(MODEL_DIR, f"{user}_model.pkl")
 
-def train_user_model(df, user):
-    df = df.copy()
-    df = df.dropna(subset=FEATURE_COLS + [TARGET_COL])
+def _invalidate_models(changes):
+    # a new entry makes the saved model stale; deleting it makes the next prediction retrain
+    for user in {c.user for c in changes if c.user}:
+        try:
+            os.remove(_model_path(user))
+        except FileNotFoundError:
+            pass
+
+# the dispatcher delivers our writes; with the change log on, jobs.catch_up_changes
+# delivers other processes' (predictions don't catch up themselves: that waits on the bus lock)
+events.subscribe("model_staleness", _invalidate_models, tables=("entries",), durable=True)
+
+def train_user_model(feats, user):
+    # feats: this user's rows from features.load_features (day t features, day t+1 focus target)
+    df = feats.dropna(subset=FEATURE_COLS + [TARGET_COL])
     if len(df) < 5:
         return False
     X = df[FEATURE_COLS]
@@ -28,27 +39,32 @@ def train_user_model(df, user):
         ("model", LinearRegression())
     ])
     pipe.fit(X, y)
-    path = os.path.join(MODEL_DIR, f"{user}_model.pkl")
-    joblib.dump(pipe, path)
+    joblib.dump(pipe, _model_path(user))
     return True
 
-def predict_next_focus(df, user):
-    model_path = os.path.join(MODEL_DIR, f"{user}_model.pkl")
-    if not os.path.exists(model_path):
-        trained = train_user_model(df, user)
-        if not trained:
+def train_all_user_models(chunk_size=ITER_CHUNK_SIZE):
+    features.update_features()
+    trained = {}
+    # iter_features yields whole users, so only a chunk's worth of rows is held at a time
+    for chunk in features.iter_features(chunk_size=chunk_size):
+        for user, part in chunk.groupby("user", sort=False):
+            trained[user] = train_user_model(part, user)
+    return trained
+
+def predict_next_focus(feats, user):
+    model_path = _model_path(user)
+    pipe = joblib.load(model_path) if os.path.exists(model_path) else None
+    # models saved before the feature store used same-day columns; retrain those
+    if pipe is None or list(getattr(pipe, "feature_names_in_", [])) != FEATURE_COLS:
+        if not train_user_model(feats, user):
             return None
-    pipe = joblib.load(model_path)
-    last_row = df.iloc[-1]
-    X_new = pd.DataFrame([{
-        "Focus": last_row["Focus"],
-        "Hyperactivity": last_row["Hyperactivity"],
-        "Impulsivity": last_row["Impulsivity"],
-        "Sleep Hours": last_row["Sleep Hours"],
-        "Distractions": last_row["Distractions"],
-        "Tasks Completed": last_row["Tasks Completed"],
-        "Screen Time": last_row.get("Screen Time", 0),
-        "Cognitive Score": last_row["Cognitive Score"],
-    }])
+        pipe = joblib.load(model_path)
+    X_new = feats[FEATURE_COLS].tail(1)
+    if X_new.empty or X_new.isna().any(axis=None):
+        return None
     pred = pipe.predict(X_new)[0]
     return round(float(pred),2)
+
+def predict_next_day(user):
+    features.update_features(user)
+    return predict_next_focus(features.load_features(user), user)
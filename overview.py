@@ -0,0 +1,102 @@
+# overview.py
+"""Every user at a glance: a focus/cognitive sparkline plus the summary cards.
+
+storage_sql.query_overview returns the last SPARK_POINTS entries and the
+whole-history averages of every user in one grouped query; rolled-up
+periods count as one point each. Sparklines are PNG files named after the
+user and their data watermark (entry count, raw entry count and highest
+entry id), so a user whose data has not changed reuses the file on disk
+and only changed users are re-rendered, in parallel. Worker processes are
+spawned, not forked, so they don't inherit the caller's threads (Tk,
+scheduler, event dispatcher) or its open SQLite connections.
+"""
+import glob
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from storage_sql import query_overview
+
+SPARK_DIR = os.path.join("cache", "sparklines")
+SPARK_POINTS = 30
+SPARK_VERSION = 1  # bump when figure_sparkline changes so old files are redrawn
+PARALLEL_MIN = 8   # below this many renders a process pool costs more than it saves
+
+def _user_key(user):
+    return hashlib.sha1(user.encode("utf-8")).hexdigest()[:16]
+
+def sparkline_path(user, n, raw_n, max_id, points=SPARK_POINTS, spark_dir=SPARK_DIR):
+    return os.path.join(spark_dir, f"{_user_key(user)}_{n}_{raw_n}_{max_id}_{points}_v{SPARK_VERSION}.png")
+
+def _render(job):
+    # top level so it can run in a worker process
+    path, series = job
+    from viz import figure_sparkline
+    tmp = path + ".tmp"
+    figure_sparkline(pd.DataFrame(series)).savefig(tmp, format="png")
+    os.replace(tmp, path)
+    return path
+
+def _prune(user, keep, spark_dir):
+    for old in glob.glob(os.path.join(spark_dir, f"{_user_key(user)}_*.png")):
+        if old != keep:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+def build_overview(points=SPARK_POINTS, spark_dir=SPARK_DIR, workers=None):
+    """One dict per user (sorted by name): user, entries, last_date, avg_* cards and sparkline path.
+
+    Returns (tiles, rendered) where rendered counts the sparklines drawn this call.
+    """
+    df = query_overview(points)
+    if df.empty:
+        return [], 0
+    os.makedirs(spark_dir, exist_ok=True)
+    tiles, jobs = [], []
+    for user, part in df.groupby("user", sort=True):
+        first = part.iloc[0]
+        path = sparkline_path(user, int(first["n"]), int(first["raw_n"]), int(first["max_id"]), points, spark_dir)
+        tiles.append({
+            "user": user,
+            "entries": int(first["n"]),
+            "last_date": part["entry_date"].iloc[-1],
+            "avg_focus": first["avg_focus"],
+            "avg_cognitive": first["avg_cognitive"],
+            "avg_sleep": first["avg_sleep"],
+            "avg_screen": first["avg_screen"],
+            "sparkline": path,
+        })
+        if not os.path.exists(path):
+            series = {"Date": part["entry_date"].tolist(), "Focus": part["focus"].tolist(),
+                      "Cognitive Score": part["cognitive_score"].tolist()}
+            jobs.append((user, path, series))
+    if len(jobs) >= PARALLEL_MIN and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            list(pool.map(_render, [(path, series) for _, path, series in jobs], chunksize=4))
+    else:
+        for _, path, series in jobs:
+            _render((path, series))
+    for user, path, _ in jobs:
+        _prune(user, path, spark_dir)
+    return tiles, len(jobs)
+
+def main():
+    import argparse
+    import time
+    import storage_sql
+    ap = argparse.ArgumentParser(description="Render the multi-user overview sparklines")
+    ap.add_argument("--points", type=int, default=SPARK_POINTS)
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+    storage_sql.init_db()
+    t0 = time.perf_counter()
+    tiles, rendered = build_overview(args.points, workers=args.workers)
+    print(f"{len(tiles)} users, {rendered} sparklines rendered in {time.perf_counter() - t0:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,28 @@
 # report.py
 import pandas as pd
 from fpdf import FPDF
+from openpyxl import Workbook
 import os
-from storage_sql import query_entries
+import events
+from storage_sql import iter_entries, ITER_CHUNK_SIZE
 
-def export_excel_for_user(user=None, start_date=None, end_date=None, out_path="export.xlsx"):
-    df = query_entries(user=user, start_date=start_date, end_date=end_date)
-    df.to_excel(out_path, index=False)
+REPORT_DIR = "reports"
+
+def export_excel_for_user(user=None, start_date=None, end_date=None, out_path="export.xlsx", chunk_size=ITER_CHUNK_SIZE):
+    # write-only workbook: rows go straight to the file, so memory stays at one chunk
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    header = False
+    for chunk in iter_entries(user=user, start_date=start_date, end_date=end_date, chunk_size=chunk_size):
+        if not header:
+            ws.append(list(chunk.columns))
+            header = True
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False):
+            ws.append(list(row))
+    wb.save(out_path)
     return out_path
 
-def export_pdf_for_user(user=None, start_date=None, end_date=None, out_path="report.pdf"):
-    df = query_entries(user=user, start_date=start_date, end_date=end_date)
+def export_pdf_for_user(user=None, start_date=None, end_date=None, out_path="report.pdf", chunk_size=ITER_CHUNK_SIZE):
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
@@ -24,15 +36,29 @@ def export_pdf_for_user(user=None, start_date=None, end_date=None, out_path="rep
         pdf.cell(28,8,str(c),border=1)
     pdf.ln()
     pdf.set_font("Arial","",9)
-    for _, r in df.iterrows():
-        pdf.cell(28,8,str(r.get("Date","")),border=1)
-        pdf.cell(28,8,str(r.get("Name","")),border=1)
-        pdf.cell(28,8,str(r.get("Focus","")),border=1)
-        pdf.cell(28,8,str(r.get("Cognitive Score","")),border=1)
-        pdf.cell(28,8,str(r.get("Sleep Hours","")),border=1)
-        pdf.cell(28,8,str(r.get("Screen Time","")),border=1)
-        pdf.cell(28,8,str(r.get("Mood","")),border=1)
-        pdf.cell(28,8,str((r.get("Notes",""))[:15]),border=1)
-        pdf.ln()
+    for df in iter_entries(user=user, start_date=start_date, end_date=end_date, chunk_size=chunk_size):
+        for _, r in df.iterrows():
+            pdf.cell(28,8,str(r.get("Date","")),border=1)
+            pdf.cell(28,8,str(r.get("Name","")),border=1)
+            pdf.cell(28,8,str(r.get("Focus","")),border=1)
+            pdf.cell(28,8,str(r.get("Cognitive Score","")),border=1)
+            pdf.cell(28,8,str(r.get("Sleep Hours","")),border=1)
+            pdf.cell(28,8,str(r.get("Screen Time","")),border=1)
+            pdf.cell(28,8,str(r.get("Mood","")),border=1)
+            notes = r.get("Notes","")
+            pdf.cell(28,8,str(notes if pd.notna(notes) else "")[:15],border=1)
+            pdf.ln()
     pdf.output(out_path)
     return out_path
+
+def watch_reports(out_dir=REPORT_DIR):
+    """Keep <out_dir>/ADHD_report_<user>.pdf current; only users with new entries are regenerated."""
+    os.makedirs(out_dir, exist_ok=True)
+
+    def regenerate(changes):
+        for user in sorted({c.user for c in changes if c.user}):
+            export_pdf_for_user(user, out_path=os.path.join(out_dir, f"ADHD_report_{user}.pdf"))
+
+    events.subscribe("report_regeneration", regenerate, tables=("entries",), durable=True)
+    # pick up whatever changed while nothing was watching
+    events.catch_up("report_regeneration")
@@ -0,0 +1,118 @@
+# reshard.py
+"""Copy entries, habits and their rollups from one database layout into another.
+
+    python reshard.py --to 4
+        adhd_app.db -> adhd_app.shard0.db .. adhd_app.shard3.db
+    python reshard.py --from-count 4 --to 8 --pattern "adhd_app.s8_{i}.db"
+        4 shards -> 8 shards
+    python reshard.py --from-count 4 --to 0 --db merged.db
+        4 shards -> one file
+
+Users are placed with storage_sql.shard_for, the same hash the running app
+uses. Entries, habits and their retention rollups (entry_rollups,
+habit_rollups, the only copy of compacted history) are copied; ids are
+reassigned by the targets. The other derived tables (features, summaries,
+anomaly state) are rebuilt from the copied rows the first time a user is
+seen. The change log and consumer offsets start empty. Point the app at the
+new layout with ADHD_SHARDS / ADHD_SHARD_PATTERN.
+"""
+import argparse
+import os
+import time
+
+from sqlalchemy import insert, inspect
+from sqlalchemy.orm import sessionmaker
+
+import storage_sql
+from storage_sql import Base, Entry, EntryRollup, Habit, HabitRollup
+
+COPIED = (Entry, Habit, EntryRollup, HabitRollup)
+COPY_BATCH = 5000
+
+def _open(path):
+    return sessionmaker(bind=storage_sql._make_engine(path))
+
+def _target_paths(count, pattern, db_file):
+    return [pattern.format(i=i) for i in range(count)] if count else [db_file]
+
+def _targets(paths, overwrite):
+    existing = [p for p in paths if os.path.exists(p)]
+    if existing and not overwrite:
+        raise SystemExit(f"{existing[0]} already exists (use --overwrite to replace it)")
+    for p in paths:
+        # a leftover WAL would be replayed into the new file
+        for f in (p, p + "-wal", p + "-shm"):
+            if os.path.exists(f):
+                os.remove(f)
+    factories = [_open(p) for p in paths]
+    for f in factories:
+        Base.metadata.create_all(bind=f.kw["bind"], tables=[m.__table__ for m in COPIED])
+    return factories
+
+def _copy_table(model, sources, targets, batch=COPY_BATCH):
+    cols = [c.key for c in model.__table__.columns if c.key != "id"]
+    copied = 0
+    for src in sources:
+        # sources written before retention rollups existed have no rollup tables
+        if not inspect(src.kw["bind"]).has_table(model.__tablename__):
+            continue
+        last = 0
+        while True:
+            session = src()
+            try:
+                rows = session.query(model).filter(model.id > last).order_by(model.id).limit(batch).all()
+            finally:
+                session.close()
+            if not rows:
+                break
+            last = rows[-1].id
+            by_target = {}
+            for r in rows:
+                by_target.setdefault(storage_sql.shard_for(r.user, len(targets)), []).append(
+                    {c: getattr(r, c) for c in cols})
+            for i, part in by_target.items():
+                session = targets[i]()
+                try:
+                    session.execute(insert(model), part)
+                    session.commit()
+                finally:
+                    session.close()
+            copied += len(rows)
+    return copied
+
+def reshard(to_count, pattern=None, db_file=None, from_count=0, from_pattern=None, from_db=None, overwrite=False):
+    from_pattern = from_pattern or storage_sql.SHARD_PATTERN
+    src_paths = [from_pattern.format(i=i) for i in range(from_count)] if from_count else [from_db or storage_sql.DB_FILE]
+    missing = [p for p in src_paths if not os.path.exists(p)]
+    if missing:
+        raise SystemExit(f"missing source database(s): {', '.join(missing)}")
+    dst_paths = _target_paths(to_count, pattern or storage_sql.SHARD_PATTERN, db_file or storage_sql.DB_FILE)
+    # checked before anything is deleted
+    if set(map(os.path.realpath, src_paths)) & set(map(os.path.realpath, dst_paths)):
+        raise SystemExit("source and target layouts overlap; pick a different --pattern/--db")
+    targets = _targets(dst_paths, overwrite)
+    sources = [_open(p) for p in src_paths]
+    counts = {m.__tablename__: _copy_table(m, sources, targets) for m in COPIED}
+    for f in sources + targets:
+        f.kw["bind"].dispose()
+    return dst_paths, counts
+
+def main():
+    ap = argparse.ArgumentParser(description="Reshard the ADHD monitor database by user")
+    ap.add_argument("--to", type=int, required=True, help="target shard count (0 = single file --db)")
+    ap.add_argument("--pattern", default=None, help="target shard file pattern, e.g. 'adhd_app.shard{i}.db'")
+    ap.add_argument("--db", default=None, help="target file when --to 0")
+    ap.add_argument("--from-count", type=int, default=0, help="source shard count (0 = single file)")
+    ap.add_argument("--from-pattern", default=None)
+    ap.add_argument("--from-db", default=None)
+    ap.add_argument("--overwrite", action="store_true")
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    paths, counts = reshard(args.to, args.pattern, args.db, args.from_count, args.from_pattern, args.from_db, args.overwrite)
+    copied = ", ".join(f"{n} {table}" for table, n in counts.items())
+    print(f"Copied {copied} into {len(paths)} file(s) in {time.perf_counter() - t0:.1f}s:")
+    for p in paths:
+        print("  " + p)
+
+if __name__ == "__main__":
+    main()
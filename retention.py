@@ -0,0 +1,173 @@
+# retention.py
+"""Roll old daily rows into weekly or monthly summaries and shrink the database.
+
+    python retention.py --months 12 --period month
+        entries/habits dated before the month that started 12 months ago
+        become one entry_rollups/habit_rollups row per user and month
+
+The cutoff is aligned to a period boundary, so a period is never split
+between raw rows and a rollup. Rollups keep n/sum/min/max per column and
+the mood counts. Compacting again merges late-arriving old rows into the
+existing period. query_entries/query_habits/iter_* return each rollup as
+one averaged row dated at its period start. The default policy comes from
+ADHD_RETENTION_MONTHS (0 = keep everything) and ADHD_ROLLUP_PERIOD.
+
+Each shard is VACUUMed after compaction so the file actually shrinks.
+"""
+import argparse
+import calendar
+import json
+import os
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import text
+
+import storage_sql
+from storage_sql import (Entry, EntryRollup, ENTRY_ROLLUP_COLS, Habit, HabitRollup, HABIT_ROLLUP_COLS)
+
+RETENTION_MONTHS = int(os.environ.get("ADHD_RETENTION_MONTHS", "0") or 0)
+ROLLUP_PERIOD = os.environ.get("ADHD_ROLLUP_PERIOD", "week")
+PERIODS = ("week", "month")
+DELETE_BATCH = 500  # stays under SQLite's bound-parameter limit
+
+# model, its date column, rolled-up columns, rollup model
+_TABLES = (
+    (Entry, Entry.entry_date, ENTRY_ROLLUP_COLS, EntryRollup),
+    (Habit, Habit.date, HABIT_ROLLUP_COLS, HabitRollup),
+)
+
+def period_start(d, period):
+    return d - timedelta(days=d.weekday()) if period == "week" else d.replace(day=1)
+
+def period_end(start, period):
+    if period == "week":
+        return start + timedelta(days=6)
+    return start.replace(day=calendar.monthrange(start.year, start.month)[1])
+
+def cutoff_date(months, period, today=None):
+    """First day kept raw: today minus months, moved back to the start of its period."""
+    today = today or date.today()
+    y, m = divmod(today.year * 12 + today.month - 1 - months, 12)
+    d = date(y, m + 1, min(today.day, calendar.monthrange(y, m + 1)[1]))
+    return period_start(d, period)
+
+def _fold(acc, r, cols):
+    acc["n"] += 1
+    for c in cols:
+        v = getattr(r, c)
+        if v is None:
+            continue
+        v = float(v)
+        acc[f"{c}_n"] += 1
+        acc[f"{c}_sum"] += v
+        acc[f"{c}_min"] = v if acc[f"{c}_min"] is None else min(acc[f"{c}_min"], v)
+        acc[f"{c}_max"] = v if acc[f"{c}_max"] is None else max(acc[f"{c}_max"], v)
+    mood = getattr(r, "mood", None)
+    if mood:
+        acc["moods"][mood] = acc["moods"].get(mood, 0) + 1
+
+def _new_acc(cols):
+    acc = {"n": 0, "moods": {}}
+    for c in cols:
+        acc.update({f"{c}_n": 0, f"{c}_sum": 0.0, f"{c}_min": None, f"{c}_max": None})
+    return acc
+
+def _merge(session, rollup, cols, user, start, period, acc):
+    row = session.query(rollup).filter_by(user=user, period=period, period_start=start).one_or_none()
+    if row is None:
+        row = rollup(user=user, period=period, period_start=start, period_end=period_end(start, period), n=0)
+        for c in cols:
+            setattr(row, f"{c}_n", 0)
+            setattr(row, f"{c}_sum", 0.0)
+        session.add(row)
+    row.n += acc["n"]
+    for c in cols:
+        setattr(row, f"{c}_n", getattr(row, f"{c}_n") + acc[f"{c}_n"])
+        setattr(row, f"{c}_sum", getattr(row, f"{c}_sum") + acc[f"{c}_sum"])
+        for agg, pick in (("min", min), ("max", max)):
+            old, new = getattr(row, f"{c}_{agg}"), acc[f"{c}_{agg}"]
+            setattr(row, f"{c}_{agg}", new if old is None else old if new is None else pick(old, new))
+    if hasattr(row, "mood_counts"):
+        moods = json.loads(row.mood_counts or "{}")
+        for mood, k in acc["moods"].items():
+            moods[mood] = moods.get(mood, 0) + k
+        row.mood_counts = json.dumps(moods, sort_keys=True)
+
+def _compact_table(session, model, date_col, cols, rollup, cutoff, period, users):
+    q = session.query(model).filter(date_col < cutoff, model.user.isnot(None), date_col.isnot(None))
+    if users:
+        q = q.filter(model.user.in_(users))
+    groups, ids = {}, []
+    for r in q.order_by(model.id).yield_per(1000):
+        key = (r.user, period_start(getattr(r, date_col.key), period))
+        _fold(groups.setdefault(key, _new_acc(cols)), r, cols)
+        ids.append(r.id)
+    for (user, start), acc in groups.items():
+        _merge(session, rollup, cols, user, start, period, acc)
+    for i in range(0, len(ids), DELETE_BATCH):
+        session.query(model).filter(model.id.in_(ids[i:i + DELETE_BATCH])).delete(synchronize_session=False)
+    return len(ids), len(groups)
+
+def _compact_shard(factory, cutoff, period, users):
+    # rollups and deletes for a shard commit together, so readers never see a row twice or not at all
+    session = factory()
+    try:
+        counts = {}
+        for model, date_col, cols, rollup in _TABLES:
+            counts[model.__tablename__] = _compact_table(session, model, date_col, cols, rollup, cutoff, period, users)
+        session.commit()
+        return counts
+    finally:
+        session.close()
+
+def vacuum(engine):
+    # VACUUM can't run inside a transaction; the checkpoint then truncates the WAL it filled
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+
+def compact(months=None, period=None, users=None, run_vacuum=True, today=None):
+    """Apply the retention policy; returns {table: (raw rows rolled up, periods touched)}.
+
+    months=None uses RETENTION_MONTHS, and 0 means keep everything raw.
+    """
+    months = RETENTION_MONTHS if months is None else int(months)
+    period = period or ROLLUP_PERIOD
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {PERIODS}, not {period!r}")
+    totals = {model.__tablename__: (0, 0) for model, *_ in _TABLES}
+    if months <= 0:
+        return totals
+    cutoff = cutoff_date(months, period, today)
+    wanted = [users] if isinstance(users, str) else list(users) if users else None
+    factories = (list(dict.fromkeys(storage_sql.session_factory(u) for u in wanted))
+                 if wanted else storage_sql.all_session_factories())
+    for factory in factories:
+        counts = _compact_shard(factory, cutoff, period, wanted)
+        for table, (rows, periods) in counts.items():
+            totals[table] = (totals[table][0] + rows, totals[table][1] + periods)
+        if run_vacuum and any(rows for rows, _ in counts.values()):
+            vacuum(factory.kw["bind"])
+    return totals
+
+def main():
+    ap = argparse.ArgumentParser(description="Roll old entries/habits into weekly or monthly summaries")
+    ap.add_argument("--months", type=int, default=RETENTION_MONTHS, help="keep this many months of daily rows")
+    ap.add_argument("--period", choices=PERIODS, default=ROLLUP_PERIOD)
+    ap.add_argument("--user", action="append", help="limit to this user (repeatable)")
+    ap.add_argument("--no-vacuum", action="store_true")
+    args = ap.parse_args()
+    if args.months <= 0:
+        raise SystemExit("nothing to do: pass --months N or set ADHD_RETENTION_MONTHS")
+    storage_sql.init_db()
+    sizes = lambda: sum(os.path.getsize(e.url.database) for e in storage_sql.all_engines() if os.path.exists(e.url.database))
+    before, t0 = sizes(), time.perf_counter()
+    totals = compact(args.months, args.period, args.user, not args.no_vacuum)
+    print(f"Rolled up rows older than {cutoff_date(args.months, args.period)} in {time.perf_counter() - t0:.1f}s:")
+    for table, (rows, periods) in totals.items():
+        print(f"  {table}: {rows} rows -> {periods} {args.period} rollups")
+    print(f"Database size {before / 1e6:.1f} MB -> {sizes() / 1e6:.1f} MB")
+
+if __name__ == "__main__":
+    main()
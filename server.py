@@ -0,0 +1,345 @@
+# server.py
+"""Local HTTP/JSON service over storage_sql, so several front ends can share one database.
+
+    python server.py --port 8765 --db adhd_app.db
+    python server.py loadtest --port 8765 --requests 2000 --concurrency 32
+
+GET  /users
+GET  /entries?user=&start=&end=
+GET  /habits?user=&start=&end=
+GET  /insights?user=&days=7
+GET  /predict?user=
+POST /entries   (one JSON object or a list)
+POST /habits    (one JSON object or a list)
+
+GET responses carry an ETag derived from the user's write watermark, so
+clients can revalidate with If-None-Match and the server only recomputes a
+response after that user's data has changed.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from aiohttp import web
+
+import storage_sql
+from logic import compute_cognitive_score, rule_based_advice, generate_insights
+
+try:
+    from ml_predict import predict_next_day
+except Exception:
+    predict_next_day = None
+
+CACHE_MAX_ENTRIES = 1024
+BATCH_MAX_ROWS = 500
+BATCH_MAX_DELAY = 0.01  # seconds to wait for more writes before flushing a batch
+
+
+class ResponseCache:
+    """Small LRU of (etag, body) keyed by request path + query."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, etag):
+        item = self._items.get(key)
+        if item is None or item[0] != etag:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key, etag, body):
+        self._items[key] = (etag, body)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+
+class WriteBatcher:
+    """Coalesces concurrent POSTs into one transaction on a single writer thread.
+
+    SQLite allows one writer at a time, so funnelling writes through one
+    thread and committing them together avoids lock contention and
+    per-row fsyncs.
+    """
+
+    def __init__(self, write_fn, max_rows=BATCH_MAX_ROWS, max_delay=BATCH_MAX_DELAY):
+        self.write_fn = write_fn
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, rows):
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, fut))
+        return await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+            while n < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                n += len(item[0])
+            rows = [r for part, _ in batch for r in part]
+            try:
+                await loop.run_in_executor(self.executor, self.write_fn, rows)
+            except Exception as e:
+                if len(batch) == 1:
+                    if not batch[0][1].done():
+                        batch[0][1].set_exception(e)
+                    continue
+                # retry each request on its own so one bad request doesn't fail the others
+                # (a sharded batch can half-commit; see storage_sql._add_all)
+                for part, fut in batch:
+                    try:
+                        await loop.run_in_executor(self.executor, self.write_fn, part)
+                    except Exception as e:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    else:
+                        if not fut.done():
+                            fut.set_result(len(part))
+                continue
+            for part, fut in batch:
+                if not fut.done():
+                    fut.set_result(len(part))
+
+
+def _df_json(df):
+    if df is None or df.empty:
+        return "[]"
+    d = df.copy()
+    if "Date" in d.columns:
+        d["Date"] = d["Date"].map(lambda v: v.isoformat() if v is not None and pd.notna(v) else None)
+    return d.to_json(orient="records")
+
+
+ENTRY_NUMBERS = ("focus", "hyperactivity", "impulsivity", "sleep_hours", "distractions",
+                 "tasks_completed", "cognitive_score", "screen_time")
+ENTRY_TEXTS = ("mood", "notes", "advice")
+HABIT_NUMBERS = ("exercise_minutes", "study_minutes", "screen_minutes")
+HABIT_TEXTS = ("notes",)
+
+
+def _check_row(obj, kind, numbers, texts, date_key):
+    # reject bad types here (400) rather than letting the write fail the whole batch
+    if not isinstance(obj, dict) or not obj.get("user"):
+        raise ValueError(f"each {kind} needs a 'user'")
+    if not isinstance(obj["user"], str):
+        raise ValueError("'user' must be a string")
+    for k in numbers:
+        v = obj.get(k)
+        if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float))):
+            raise ValueError(f"'{k}' must be a number")
+    for k in texts:
+        v = obj.get(k)
+        if v is not None and not isinstance(v, str):
+            raise ValueError(f"'{k}' must be a string")
+    d = obj.get(date_key)
+    if d is not None and (not isinstance(d, str) or storage_sql._fix_date(d) is None):
+        raise ValueError(f"'{date_key}' is not a date: {d!r}")
+    return dict(obj)
+
+
+def _entry_from_json(obj):
+    row = _check_row(obj, "entry", ENTRY_NUMBERS, ENTRY_TEXTS, "entry_date")
+    if row.get("cognitive_score") is None:
+        row["cognitive_score"] = compute_cognitive_score(row)
+    row.setdefault("advice", "")
+    return row
+
+
+def _habit_from_json(obj):
+    return _check_row(obj, "habit", HABIT_NUMBERS, HABIT_TEXTS, "date")
+
+
+# ---- GET handlers: return a JSON string, run on the reader pool ----
+
+def _get_users(q):
+    return json.dumps(storage_sql.get_users())
+
+def _get_entries(q):
+    return _df_json(storage_sql.query_entries(user=q.get("user"), start_date=q.get("start"), end_date=q.get("end")))
+
+def _get_habits(q):
+    return _df_json(storage_sql.query_habits(user=q.get("user"), start_date=q.get("start"), end_date=q.get("end")))
+
+def _insights_days(q):
+    try:
+        days = int(q.get("days") or 7)
+    except ValueError:
+        raise ValueError("days must be a whole number")
+    if days < 1:
+        raise ValueError("days must be at least 1")
+    return days
+
+def _get_insights(q):
+    df = storage_sql.query_entries(user=q.get("user"))
+    days = _insights_days(q)
+    return json.dumps({"insights": generate_insights(df, days=days), "advice": rule_based_advice(df)})
+
+def _get_predict(q):
+    user = q.get("user")
+    pred = predict_next_day(user) if predict_next_day is not None else None
+    return json.dumps({"user": user, "next_focus": pred})
+
+
+def create_app(db_file=None, pool_size=5, readers=8, shards=None):
+    storage_sql.configure_engine(db_file, pool_size=pool_size, max_overflow=readers)
+    if shards is not None:
+        storage_sql.configure_shards(shards, pool_size=pool_size, max_overflow=readers)
+    storage_sql.init_db()
+
+    app = web.Application()
+    cache = ResponseCache()
+    reader_pool = ThreadPoolExecutor(max_workers=readers)
+    batchers = {
+        "entries": WriteBatcher(storage_sql.add_entries),
+        "habits": WriteBatcher(storage_sql.add_habits),
+    }
+    app["cache"] = cache
+
+    def cached_get(fn, require_user=False, check=None):
+        async def handler(request):
+            q = dict(request.query)
+            if require_user and not q.get("user"):
+                raise web.HTTPBadRequest(text="user is required")
+            if check is not None:
+                try:
+                    check(q)
+                except ValueError as e:
+                    raise web.HTTPBadRequest(text=str(e))
+            loop = asyncio.get_running_loop()
+            # no user -> whole-table watermark
+            watermark = await loop.run_in_executor(reader_pool, storage_sql.get_user_watermark, q.get("user"))
+            key = request.path + "?" + "&".join(f"{k}={q[k]}" for k in sorted(q))
+            etag = '"' + hashlib.sha1(f"{key}|{watermark}".encode()).hexdigest() + '"'
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers={"ETag": etag})
+            body = cache.get(key, etag)
+            if body is None:
+                body = await loop.run_in_executor(reader_pool, fn, q)
+                cache.put(key, etag, body)
+            return web.Response(text=body, content_type="application/json", headers={"ETag": etag})
+        return handler
+
+    def batched_post(kind, parse):
+        async def handler(request):
+            try:
+                payload = await request.json()
+                items = payload if isinstance(payload, list) else [payload]
+                rows = [parse(o) for o in items]
+            except ValueError as e:
+                raise web.HTTPBadRequest(text=str(e))
+            n = await batchers[kind].submit(rows)
+            return web.json_response({"inserted": n}, status=201)
+        return handler
+
+    async def health(request):
+        return web.json_response({"ok": True, "cache_hits": cache.hits, "cache_misses": cache.misses})
+
+    async def on_startup(app):
+        for b in batchers.values():
+            b.start()
+
+    async def on_cleanup(app):
+        for b in batchers.values():
+            await b.stop()
+        reader_pool.shutdown(wait=True)
+        for engine in storage_sql.all_engines():
+            engine.dispose()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get("/health", health)
+    app.router.add_get("/users", cached_get(_get_users))
+    app.router.add_get("/entries", cached_get(_get_entries))
+    app.router.add_get("/habits", cached_get(_get_habits))
+    app.router.add_get("/insights", cached_get(_get_insights, require_user=True, check=_insights_days))
+    app.router.add_get("/predict", cached_get(_get_predict, require_user=True))
+    app.router.add_post("/entries", batched_post("entries", _entry_from_json))
+    app.router.add_post("/habits", batched_post("habits", _habit_from_json))
+    return app
+
+
+def loadtest(host, port, requests=1000, concurrency=16, user=None):
+    # stdlib-only client so load tests need nothing beyond a running server
+    import urllib.request
+    base = f"http://{host}:{port}"
+    user = user or "loadtest"
+    paths = [f"/entries?user={user}", f"/insights?user={user}", "/users"]
+
+    def one(i):
+        t0 = time.perf_counter()
+        if i % 10 == 0:
+            body = json.dumps({"user": user, "entry_date": "2025-01-01", "focus": 5, "sleep_hours": 7}).encode()
+            req = urllib.request.Request(base + "/entries", data=body, method="POST", headers={"Content-Type": "application/json"})
+        else:
+            req = urllib.request.Request(base + paths[i % len(paths)])
+        with urllib.request.urlopen(req) as resp:
+            resp.read()
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        lat = sorted(ex.map(one, range(requests)))
+    total = time.perf_counter() - t0
+    print(f"{requests} requests in {total:.2f}s ({requests/total:.0f} req/s), "
+          f"p50 {lat[len(lat)//2]*1000:.1f}ms, p99 {lat[int(len(lat)*0.99)-1]*1000:.1f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ADHD monitor local HTTP service")
+    ap.add_argument("command", nargs="?", default="serve", choices=["serve", "loadtest"])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--db", default=storage_sql.DB_FILE)
+    ap.add_argument("--pool-size", type=int, default=5)
+    ap.add_argument("--readers", type=int, default=8)
+    ap.add_argument("--shards", type=int, default=None, help="per-user shard count (default: ADHD_SHARDS)")
+    ap.add_argument("--requests", type=int, default=1000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--user", default=None)
+    args = ap.parse_args()
+    if args.command == "loadtest":
+        loadtest(args.host, args.port, args.requests, args.concurrency, args.user)
+    else:
+        web.run_app(create_app(args.db, args.pool_size, args.readers, args.shards), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
 # storage_sql.py
-from sqlalchemy import Column, Integer, String, Float, Date, create_engine
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Index, UniqueConstraint, create_engine, event, func, inspect, or_, text, tuple_
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
+from itertools import chain
+import json
+import zlib
 import pandas as pd
 import os
 
@@ -9,6 +15,13 @@ Base = declarative_base()
 DB_FILE = "adhd_app.db"
 ENGINE = create_engine(f"sqlite:///{DB_FILE}", echo=False, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(bind=ENGINE)
+ITER_CHUNK_SIZE = 1000
+
+# optional per-user sharding: ADHD_SHARDS=N routes each user to one of N files
+SHARD_COUNT = int(os.environ.get("ADHD_SHARDS", "0") or 0)
+SHARD_PATTERN = os.environ.get("ADHD_SHARD_PATTERN", "adhd_app.shard{i}.db")
+SHARDS = []  # one sessionmaker per shard file; empty means everything is in ENGINE
+_fanout_pool = None
 
 class Entry(Base):
     __tablename__ = "entries"
@@ -37,8 +50,219 @@ class Habit(Base):
     screen_minutes = Column(Integer, default=0)
     notes = Column(String)
 
+# Rows past the retention window (see retention.py) are folded into one row
+# per user and week/month. Per column the rollup keeps n, sum, min and max,
+# so later compactions can merge into an existing period.
+ENTRY_ROLLUP_COLS = ("focus", "hyperactivity", "impulsivity", "sleep_hours", "distractions",
+                     "tasks_completed", "cognitive_score", "screen_time")
+HABIT_ROLLUP_COLS = ("exercise_minutes", "study_minutes", "screen_minutes")
+
+def _rollup_attrs(table, cols):
+    attrs = {
+        "__tablename__": table,
+        "__table_args__": (UniqueConstraint("user", "period", "period_start"),),
+        "id": Column(Integer, primary_key=True),
+        "user": Column(String, index=True),
+        "period": Column(String),  # "week" or "month"
+        "period_start": Column(Date),
+        "period_end": Column(Date),
+        "n": Column(Integer, default=0),
+    }
+    for c in cols:
+        attrs[f"{c}_n"] = Column(Integer, default=0)
+        attrs[f"{c}_sum"] = Column(Float, default=0.0)
+        attrs[f"{c}_min"] = Column(Float)
+        attrs[f"{c}_max"] = Column(Float)
+    return attrs
+
+EntryRollup = type("EntryRollup", (Base,), {
+    **_rollup_attrs("entry_rollups", ENTRY_ROLLUP_COLS),
+    "mood_counts": Column(String),  # JSON {mood: count}
+})
+HabitRollup = type("HabitRollup", (Base,), _rollup_attrs("habit_rollups", HABIT_ROLLUP_COLS))
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String)
+    op = Column(String)
+    user = Column(String, index=True)
+    date = Column(Date)
+    row_id = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# seq is the change_log id, or None when the change log is off
+ChangeEvent = namedtuple("ChangeEvent", ["seq", "table", "op", "user", "date", "row_id"])
+
+# writes go to change_log once the table exists in this database (see enable_change_log)
+CHANGE_LOG = False
+# ADHD_CHANGE_LOG=1 makes init_db() create the table
+CHANGE_LOG_ENV = os.environ.get("ADHD_CHANGE_LOG", "0") not in ("", "0")
+_write_hooks = []
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    # WAL lets readers proceed while one writer commits
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
+
+def _make_engine(db_file, pool_size=5, max_overflow=10, wal=True):
+    engine = create_engine(
+        f"sqlite:///{db_file}", echo=False,
+        connect_args={"check_same_thread": False},
+        pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True
+    )
+    if wal:
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+def configure_engine(db_file=None, pool_size=5, max_overflow=10, wal=True):
+    """Rebind ENGINE/SessionLocal to a pooled engine, for long-running multi-client processes."""
+    global ENGINE, DB_FILE
+    DB_FILE = db_file or DB_FILE
+    engine = _make_engine(DB_FILE, pool_size, max_overflow, wal)
+    old = ENGINE
+    ENGINE = engine
+    SessionLocal.configure(bind=ENGINE)
+    old.dispose()
+    return ENGINE
+
+def configure_shards(n, pattern=None, pool_size=5, max_overflow=10, wal=True):
+    """Route every user's rows to one of n SQLite files (n=0 turns sharding off).
+
+    Each shard is a complete database: entries, habits and every per-user
+    derived table (change log, features, summaries) live on the user's shard.
+    """
+    global SHARD_COUNT, SHARD_PATTERN, SHARDS
+    for sm in SHARDS:
+        sm.kw["bind"].dispose()
+    SHARD_COUNT = int(n or 0)
+    SHARD_PATTERN = pattern or SHARD_PATTERN
+    SHARDS = [sessionmaker(bind=_make_engine(SHARD_PATTERN.format(i=i), pool_size, max_overflow, wal))
+              for i in range(SHARD_COUNT)]
+    return SHARDS
+
+def shard_for(user, n):
+    # crc32 rather than hash(): stable across processes and Python versions
+    return zlib.crc32((user or "").encode("utf-8")) % n if n else 0
+
+def session_factory(user):
+    return SHARDS[shard_for(user, len(SHARDS))] if SHARDS else SessionLocal
+
+def session_for(user):
+    return session_factory(user)()
+
+def engine_for(user):
+    return session_factory(user).kw["bind"]
+
+def all_session_factories():
+    return SHARDS or [SessionLocal]
+
+def all_engines():
+    return [sm.kw["bind"] for sm in all_session_factories()]
+
+def fan_out(fn, targets=None):
+    """Run fn(target) for every shard (sessionmaker by default) in parallel; results in shard order."""
+    global _fanout_pool
+    targets = list(targets if targets is not None else all_session_factories())
+    if len(targets) == 1:
+        return [fn(targets[0])]
+    if _fanout_pool is None:
+        _fanout_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="shard")
+    return list(_fanout_pool.map(fn, targets))
+
+# keyset indexes for the streaming iterators (user, date, id)
+ENTRY_KEYSET_INDEX = Index("ix_entries_user_date_id", Entry.user, Entry.entry_date, Entry.id)
+HABIT_KEYSET_INDEX = Index("ix_habits_user_date_id", Habit.user, Habit.date, Habit.id)
+
+# full-text index over entry and habit notes; rowid = id*2 (+1 for habits) so
+# triggers can find a source row's index entry without a scan
+FTS_TABLE = "notes_fts"
+FTS_ENABLED = False
+_FTS_SOURCES = (("entries", "entry_date", 0), ("habits", "date", 1))
+
+def _ensure_fts(engine):
+    with engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name=:n"), {"n": FTS_TABLE}).first()
+        if not exists:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+                "notes, user, date UNINDEXED, tokenize='unicode61 remove_diacritics 2')"))
+        for table, date_col, bit in _FTS_SOURCES:
+            ins = (f"INSERT INTO {FTS_TABLE}(rowid, notes, user, date) "
+                   f"SELECT new.id*2+{bit}, new.notes, new.user, new.{date_col} WHERE coalesce(new.notes, '') <> '';")
+            dele = f"DELETE FROM {FTS_TABLE} WHERE rowid = old.id*2+{bit};"
+            conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN {ins} END"))
+            conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN {dele} END"))
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF notes, user, {date_col} ON {table} "
+                f"BEGIN {dele} {ins} END"))
+            if not exists:
+                # index the rows written before the index existed
+                conn.execute(text(
+                    f"INSERT INTO {FTS_TABLE}(rowid, notes, user, date) "
+                    f"SELECT id*2+{bit}, notes, user, {date_col} FROM {table} WHERE coalesce(notes, '') <> ''"))
+
 def init_db():
-    Base.metadata.create_all(bind=ENGINE)
+    global CHANGE_LOG, FTS_ENABLED
+    # change_log is opt-in: don't let create_all add it
+    tables = [t for t in Base.metadata.sorted_tables if t.name != ChangeLog.__tablename__]
+    for engine in all_engines():
+        Base.metadata.create_all(bind=engine, tables=tables)
+        # create_all skips indexes on tables that already exist
+        for ix in (ENTRY_KEYSET_INDEX, HABIT_KEYSET_INDEX):
+            ix.create(bind=engine, checkfirst=True)
+    CHANGE_LOG = inspect(all_engines()[0]).has_table(ChangeLog.__tablename__)
+    if CHANGE_LOG_ENV:
+        enable_change_log()
+    try:
+        for engine in all_engines():
+            _ensure_fts(engine)
+        FTS_ENABLED = True
+    except OperationalError:
+        # SQLite built without FTS5; search_notes falls back to LIKE
+        FTS_ENABLED = False
+
+DATE_FORMATS = ("%Y-%m-%d","%d-%m-%Y","%m/%d/%Y","%m/%d/%y")
+DATE_SAMPLE_SIZE = 50
+_DATE_FORMAT_CACHE = {}  # source file -> last inferred format
+
+def enable_change_log(enabled=True):
+    """Persist every write to change_log so consumers can catch up after a restart.
+
+    Enabling creates the table, after which every process that calls
+    init_db() on this database logs its writes too.
+    """
+    global CHANGE_LOG
+    if enabled:
+        for engine in all_engines():
+            ChangeLog.__table__.create(bind=engine, checkfirst=True)
+    CHANGE_LOG = enabled
+
+def on_write(fn):
+    # fn(events) is called after each committed write with a list of ChangeEvent
+    _write_hooks.append(fn)
+    return fn
+
+def _commit_with_events(session, table, objs):
+    session.flush()
+    date_attr = "entry_date" if table == "entries" else "date"
+    changes = [(table, "insert", o.user, getattr(o, date_attr), o.id) for o in objs]
+    logs = []
+    if CHANGE_LOG:
+        # same transaction as the data, so the log never misses or invents a write
+        logs = [ChangeLog(table_name=t, op=op, user=u, date=d, row_id=i) for t, op, u, d, i in changes]
+        session.add_all(logs)
+        session.flush()
+    seqs = [l.seq for l in logs] or [None]*len(changes)
+    session.commit()
+    events = [ChangeEvent(seq, *c) for seq, c in zip(seqs, changes)]
+    for hook in _write_hooks:
+        hook(events)
+    return events
 
 def _fix_date(d):
     if d is None:
@@ -48,19 +272,73 @@ def _fix_date(d):
     if isinstance(d, datetime):
         return d.date()
     s = str(d).strip()
-    for fmt in ("%Y-%m-%d","%d-%m-%Y","%m/%d/%Y","%m/%d/%y"):
+    if not s:
+        return None
+    for fmt in DATE_FORMATS:
         try:
             return datetime.strptime(s, fmt).date()
         except Exception:
             pass
     try:
-        return pd.to_datetime(s).date()
+        ts = pd.to_datetime(s)
     except Exception:
         return None
+    return None if pd.isna(ts) else ts.date()
 
-def add_entry(row):
-    session = SessionLocal()
-    e = Entry(
+def _infer_date_format(sample):
+    best, best_n = None, 0
+    for fmt in DATE_FORMATS:
+        n = pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum()
+        if n > best_n:
+            best, best_n = fmt, n
+    return best
+
+def normalize_dates(values, source=None, sample_size=DATE_SAMPLE_SIZE):
+    """Parse a whole column of dates at once.
+
+    The format is inferred from a sample (and cached per source file), the
+    column is parsed in one vectorized call, and only values that don't
+    match fall back to _fix_date. Returns (dates, failed) where dates is an
+    object Series of datetime.date/None aligned with values and failed lists
+    the index labels of non-blank values that could not be parsed.
+    """
+    s = pd.Series(values)
+    out = pd.Series([None]*len(s), index=s.index, dtype=object)
+    if s.empty:
+        return out, []
+    if pd.api.types.is_datetime64_any_dtype(s):
+        ok = s.notna()
+        out[ok] = s[ok].dt.date
+        return out, []
+
+    # blank cells are missing, not unparseable
+    present = s.notna() & ~s.map(lambda v: isinstance(v, str) and not v.strip())
+    is_date = present & s.map(lambda v: isinstance(v, (date, datetime)))
+    if is_date.any():
+        out[is_date] = pd.to_datetime(s[is_date]).dt.date
+    text_vals = s[present & ~is_date].astype(str).str.strip()
+    if not text_vals.empty:
+        sample = text_vals.head(sample_size)
+        fmt = _DATE_FORMAT_CACHE.get(source) if source else None
+        # a cached format that no longer fits most of the sample is re-inferred
+        if fmt is None or pd.to_datetime(sample, format=fmt, errors="coerce").notna().sum() * 2 < len(sample):
+            fmt = _infer_date_format(sample)
+            if source and fmt:
+                _DATE_FORMAT_CACHE[source] = fmt
+        if fmt:
+            parsed = pd.to_datetime(text_vals, format=fmt, errors="coerce")
+            ok = parsed.notna()
+            out[ok[ok].index] = parsed[ok].dt.date
+            stragglers = text_vals[~ok]
+        else:
+            stragglers = text_vals
+        if not stragglers.empty:
+            out[stragglers.index] = stragglers.map(_fix_date)
+    failed = out.index[present & out.isna()].tolist()
+    return out, failed
+
+def _make_entry(row):
+    return Entry(
         user = row.get("user"),
         entry_date = _fix_date(row.get("entry_date")),
         focus = row.get("focus"),
@@ -75,13 +353,9 @@ def add_entry(row):
         advice = row.get("advice"),
         screen_time = row.get("screen_time", 0.0)
     )
-    session.add(e)
-    session.commit()
-    session.close()
 
-def add_habit(h):
-    session = SessionLocal()
-    hrow = Habit(
+def _make_habit(h):
+    return Habit(
         user = h.get("user"),
         date = _fix_date(h.get("date")),
         exercise_minutes = h.get("exercise_minutes",0),
@@ -89,73 +363,443 @@ def add_habit(h):
         screen_minutes = h.get("screen_minutes",0),
         notes = h.get("notes","")
     )
+
+def add_entry(row):
+    e = _make_entry(row)
+    session = session_for(e.user)
+    session.add(e)
+    _commit_with_events(session, "entries", [e])
+    session.close()
+
+def add_habit(h):
+    hrow = _make_habit(h)
+    session = session_for(hrow.user)
     session.add(hrow)
-    session.commit()
+    _commit_with_events(session, "habits", [hrow])
     session.close()
 
-def query_entries(user=None, start_date=None, end_date=None):
-    session = SessionLocal()
-    q = session.query(Entry)
+def _add_all(table, objs):
+    # one transaction per shard; a batch spanning shards is not atomic across them
+    by_shard = {}
+    for o in objs:
+        by_shard.setdefault(session_factory(o.user), []).append(o)
+    for factory, part in by_shard.items():
+        session = factory()
+        try:
+            session.add_all(part)
+            _commit_with_events(session, table, part)
+        finally:
+            session.close()
+    return len(objs)
+
+def add_entries(rows):
+    # one transaction for the whole batch instead of a commit per row
+    return _add_all("entries", [_make_entry(r) for r in rows])
+
+def add_habits(habits):
+    return _add_all("habits", [_make_habit(h) for h in habits])
+
+def import_entries_df(df, source=None):
+    """Bulk-import a spreadsheet frame (app column names). Returns (inserted, failed date rows)."""
+    if df is None or df.empty:
+        return 0, []
+    dates, failed = normalize_dates(df["Date"] if "Date" in df.columns else [None]*len(df), source=source)
+    dates.index = df.index
+    bad = set(failed)
+    today = date.today()
+    rows = []
+    for idx, r in zip(df.index, df.to_dict("records")):
+        if idx in bad:
+            continue
+        rows.append({
+            "user": r.get("Name") or "Unknown",
+            "entry_date": dates[idx] or today,
+            "focus": int(r.get("Focus") or 0),
+            "hyperactivity": int(r.get("Hyperactivity") or 0),
+            "impulsivity": int(r.get("Impulsivity") or 0),
+            "sleep_hours": float(r.get("Sleep Hours") or 0),
+            "distractions": int(r.get("Distractions") or 0),
+            "tasks_completed": int(r.get("Tasks Completed") or 0),
+            "mood": r.get("Mood") or "",
+            "notes": r.get("Notes") or "",
+            "cognitive_score": float(r.get("Cognitive Score") or 0),
+            "advice": r.get("Advice") or "",
+            "screen_time": float(r.get("Screen Time") or 0.0)
+        })
+    add_entries(rows)
+    return len(rows), failed
+
+def _entry_to_dict(r):
+    return {
+        "Date": r.entry_date,
+        "Name": r.user,
+        "Focus": r.focus,
+        "Hyperactivity": r.hyperactivity,
+        "Impulsivity": r.impulsivity,
+        "Sleep Hours": r.sleep_hours,
+        "Distractions": r.distractions,
+        "Tasks Completed": r.tasks_completed,
+        "Mood": r.mood,
+        "Notes": r.notes,
+        "Cognitive Score": r.cognitive_score,
+        "Advice": r.advice,
+        "Screen Time": r.screen_time
+    }
+
+def _habit_to_dict(r):
+    return {
+        "Date": r.date,
+        "User": r.user,
+        "Exercise Minutes": r.exercise_minutes,
+        "Study Minutes": r.study_minutes,
+        "Screen Minutes": r.screen_minutes,
+        "Notes": r.notes
+    }
+
+def _rollup_mean(r, col):
+    n = getattr(r, f"{col}_n")
+    return getattr(r, f"{col}_sum") / n if n else None
+
+def _entry_rollup_to_dict(r):
+    moods = json.loads(r.mood_counts or "{}")
+    return {
+        "Date": r.period_start,
+        "Name": r.user,
+        "Focus": _rollup_mean(r, "focus"),
+        "Hyperactivity": _rollup_mean(r, "hyperactivity"),
+        "Impulsivity": _rollup_mean(r, "impulsivity"),
+        "Sleep Hours": _rollup_mean(r, "sleep_hours"),
+        "Distractions": _rollup_mean(r, "distractions"),
+        "Tasks Completed": _rollup_mean(r, "tasks_completed"),
+        "Mood": max(moods, key=moods.get) if moods else None,
+        "Notes": f"{r.period}ly rollup of {r.n} entries ({r.period_start} to {r.period_end})",
+        "Cognitive Score": _rollup_mean(r, "cognitive_score"),
+        "Advice": None,
+        "Screen Time": _rollup_mean(r, "screen_time")
+    }
+
+def _habit_rollup_to_dict(r):
+    return {
+        "Date": r.period_start,
+        "User": r.user,
+        "Exercise Minutes": _rollup_mean(r, "exercise_minutes"),
+        "Study Minutes": _rollup_mean(r, "study_minutes"),
+        "Screen Minutes": _rollup_mean(r, "screen_minutes"),
+        "Notes": f"{r.period}ly rollup of {r.n} habits ({r.period_start} to {r.period_end})"
+    }
+
+# raw table -> (rollup table, row converter); readers return rollup rows as one
+# averaged row per period, dated at the period start
+_ROLLUPS = {Entry: (EntryRollup, _entry_rollup_to_dict), Habit: (HabitRollup, _habit_rollup_to_dict)}
+
+def _rollup_rows(session, model, user, start_date, end_date):
+    rollup, to_dict = _ROLLUPS[model]
+    q = session.query(rollup)
+    if user:
+        q = q.filter(rollup.user==user)
+    # a period counts when it overlaps the range
+    sd, ed = _fix_date(start_date), _fix_date(end_date)
+    if sd:
+        q = q.filter(rollup.period_end >= sd)
+    if ed:
+        q = q.filter(rollup.period_start <= ed)
+    return [to_dict(r) for r in q.order_by(rollup.user, rollup.period_start).all()]
+
+def _filter_range(q, model, date_col, user, start_date, end_date):
     if user:
-        q = q.filter(Entry.user==user)
+        q = q.filter(model.user==user)
     if start_date:
         sd = _fix_date(start_date)
         if sd:
-            q = q.filter(Entry.entry_date >= sd)
+            q = q.filter(date_col >= sd)
     if end_date:
         ed = _fix_date(end_date)
         if ed:
-            q = q.filter(Entry.entry_date <= ed)
-    rows = q.order_by(Entry.entry_date).all()
-    session.close()
-    data = []
-    for r in rows:
-        data.append({
-            "Date": r.entry_date,
-            "Name": r.user,
-            "Focus": r.focus,
-            "Hyperactivity": r.hyperactivity,
-            "Impulsivity": r.impulsivity,
-            "Sleep Hours": r.sleep_hours,
-            "Distractions": r.distractions,
-            "Tasks Completed": r.tasks_completed,
-            "Mood": r.mood,
-            "Notes": r.notes,
-            "Cognitive Score": r.cognitive_score,
-            "Advice": r.advice,
-            "Screen Time": r.screen_time
-        })
-    return pd.DataFrame(data)
+            q = q.filter(date_col <= ed)
+    return q
+
+def _query_rows(factory, model, date_col, to_dict, user, start_date, end_date):
+    session = factory()
+    try:
+        q = _filter_range(session.query(model), model, date_col, user, start_date, end_date)
+        rows = [to_dict(r) for r in q.order_by(date_col).all()]
+        rolled = _rollup_rows(session, model, user, start_date, end_date)
+        if rolled:
+            # same order as the SQL above: undated rows first, then by date (rollups before raw rows of a day)
+            rows = sorted(rolled + rows, key=lambda d: (d["Date"] is not None, d["Date"] or date.min))
+        return rows
+    finally:
+        session.close()
+
+def _query(model, date_col, to_dict, user, start_date, end_date):
+    if user or not SHARDS:
+        return pd.DataFrame(_query_rows(session_factory(user), model, date_col, to_dict, user, start_date, end_date))
+    parts = fan_out(lambda f: _query_rows(f, model, date_col, to_dict, None, start_date, end_date))
+    df = pd.DataFrame(list(chain.from_iterable(parts)))
+    # shards are each sorted by date; restore one global date order
+    return df.sort_values("Date", kind="stable", na_position="first").reset_index(drop=True) if not df.empty else df
+
+def query_entries(user=None, start_date=None, end_date=None):
+    return _query(Entry, Entry.entry_date, _entry_to_dict, user, start_date, end_date)
 
 def query_habits(user=None, start_date=None, end_date=None):
-    session = SessionLocal()
-    q = session.query(Habit)
+    return _query(Habit, Habit.date, _habit_to_dict, user, start_date, end_date)
+
+def _fetch_page(factory, model, date_col, user, start_date, end_date, keyed, after, chunk_size):
+    # one short session per page so no read transaction is held between chunks
+    session = factory()
+    try:
+        q = _filter_range(session.query(model), model, date_col, user, start_date, end_date)
+        if keyed:
+            q = q.filter(model.user.isnot(None), date_col.isnot(None))
+            if after is not None:
+                q = q.filter(tuple_(model.user, date_col, model.id) > tuple_(*after))
+            q = q.order_by(model.user, date_col, model.id)
+        else:
+            # NULL user/date rows can't take part in a row-value comparison; page them by id
+            q = q.filter(or_(model.user.is_(None), date_col.is_(None)))
+            if after is not None:
+                q = q.filter(model.id > after)
+            q = q.order_by(model.id)
+        return q.limit(chunk_size).all()
+    finally:
+        session.close()
+
+def _iter_keyset(model, date_col, to_dict, user, start_date, end_date, chunk_size):
+    chunk_size = max(1, int(chunk_size or ITER_CHUNK_SIZE))
+    ukey = "Name" if model is Entry else "User"
+    # a user lives on one shard, so walking shards in turn keeps each user contiguous
+    factories = [session_factory(user)] if user else all_session_factories()
+    buf = []
+    for factory in factories:
+        session = factory()
+        try:
+            # one row per period, so a shard's rollups are small enough to hold
+            rolled = deque(_rollup_rows(session, model, user, start_date, end_date))
+        finally:
+            session.close()
+        for keyed in (False, True):
+            after = None
+            while True:
+                rows = _fetch_page(factory, model, date_col, user, start_date, end_date, keyed, after, chunk_size)
+                for r in rows:
+                    d = to_dict(r)
+                    if keyed:
+                        # rollups cover each user's oldest periods: emit them (and those of
+                        # rollup-only users sorting earlier) just before the user's first raw row
+                        while rolled and rolled[0][ukey] <= d[ukey]:
+                            buf.append(rolled.popleft())
+                    buf.append(d)
+                    if len(buf) >= chunk_size:
+                        yield pd.DataFrame(buf[:chunk_size])
+                        del buf[:chunk_size]
+                if len(rows) < chunk_size:
+                    break
+                last = rows[-1]
+                after = (last.user, getattr(last, date_col.key), last.id) if keyed else last.id
+        buf.extend(rolled)
+        while len(buf) >= chunk_size:
+            yield pd.DataFrame(buf[:chunk_size])
+            del buf[:chunk_size]
+    if buf:
+        yield pd.DataFrame(buf)
+
+def iter_entries(user=None, start_date=None, end_date=None, chunk_size=ITER_CHUNK_SIZE):
+    """Yield entry DataFrames of at most chunk_size rows, ordered by (user, date, id).
+
+    Pages by keyset instead of OFFSET, so memory stays bounded and later pages
+    cost the same as the first. Rows of one user are contiguous across chunks
+    (in sharded mode users come shard by shard, each shard sorted by user).
+    Rows with no user or date lead each shard. A user's rolled-up periods
+    (retention.py) come just before their raw rows, so each user's rows stay
+    contiguous and in date order.
+    """
+    return _iter_keyset(Entry, Entry.entry_date, _entry_to_dict, user, start_date, end_date, chunk_size)
+
+def iter_habits(user=None, start_date=None, end_date=None, chunk_size=ITER_CHUNK_SIZE):
+    """Same as iter_entries, for the habits table."""
+    return _iter_keyset(Habit, Habit.date, _habit_to_dict, user, start_date, end_date, chunk_size)
+
+def _fts_query(query):
+    # user text becomes quoted terms (implicit AND); a trailing * keeps prefix search
+    terms = []
+    for tok in str(query or "").split():
+        prefix = tok.endswith("*")
+        tok = tok.rstrip("*").replace('"', '""')
+        if tok:
+            terms.append(f'"{tok}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def _search_shard(factory, user, query, start_date, end_date, limit):
+    match = _fts_query(query)
+    if not match:
+        return []
     if user:
-        q = q.filter(Habit.user==user)
-    if start_date:
-        sd = _fix_date(start_date)
-        if sd:
-            q = q.filter(Habit.date >= sd)
-    if end_date:
-        ed = _fix_date(end_date)
-        if ed:
-            q = q.filter(Habit.date <= ed)
-    rows = q.order_by(Habit.date).all()
-    session.close()
-    data = []
-    for r in rows:
-        data.append({
-            "Date": r.date,
-            "User": r.user,
-            "Exercise Minutes": r.exercise_minutes,
-            "Study Minutes": r.study_minutes,
-            "Screen Minutes": r.screen_minutes,
-            "Notes": r.notes
-        })
-    return pd.DataFrame(data)
+        # restricting by user inside MATCH lets FTS intersect the postings instead of filtering after
+        match = 'user : "{}" AND notes : ({})'.format(user.replace('"', '""'), match)
+    else:
+        match = f"notes : ({match})"
+    sql = (f"SELECT rowid, user, date, notes, "
+           f"snippet({FTS_TABLE}, 0, '[', ']', '…', 12) AS snip, bm25({FTS_TABLE}, 1.0, 0.0) AS score "
+           f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :m")
+    params = {"m": match, "lim": limit}
+    if user:
+        # the phrase match above also accepts longer names that contain this one
+        sql += " AND user = :u"
+        params["u"] = user
+    sd, ed = _fix_date(start_date) if start_date else None, _fix_date(end_date) if end_date else None
+    if sd:
+        sql += " AND date >= :sd"
+        params["sd"] = sd.isoformat()
+    if ed:
+        sql += " AND date <= :ed"
+        params["ed"] = ed.isoformat()
+    sql += " ORDER BY score LIMIT :lim"
+    session = factory()
+    try:
+        return [
+            {"Source": "habit" if r.rowid % 2 else "entry", "Date": _fix_date(r.date), "Name": r.user,
+             "Notes": r.notes, "Snippet": r.snip, "Score": -r.score}
+            for r in session.execute(text(sql), params)
+        ]
+    finally:
+        session.close()
 
-def get_users():
-    session = SessionLocal()
-    users = session.query(Entry.user).distinct().all()
-    session.close()
-    return [u[0] for u in users if u[0] is not None]
+def _like_shard(factory, user, query, start_date, end_date, limit):
+    rows = []
+    session = factory()
+    try:
+        for model, date_col, source in ((Entry, Entry.entry_date, "entry"), (Habit, Habit.date, "habit")):
+            q = _filter_range(session.query(model), model, date_col, user, start_date, end_date)
+            for tok in str(query or "").replace("*", "").split():
+                q = q.filter(model.notes.ilike(f"%{tok}%"))
+            for r in q.order_by(date_col.desc()).limit(limit).all():
+                rows.append({"Source": source, "Date": getattr(r, date_col.key), "Name": r.user,
+                             "Notes": r.notes, "Snippet": r.notes, "Score": 0.0})
+        return rows
+    finally:
+        session.close()
+
+def search_notes(user=None, query="", start_date=None, end_date=None, limit=20, offset=0):
+    """Ranked full-text search over entry and habit notes.
+
+    Terms are ANDed; end a term with * for prefix matching. Returns one page
+    (limit rows after skipping offset) as a DataFrame with Source, Date,
+    Name, Notes, Snippet and Score (higher is better).
+    """
+    if not str(query or "").strip():
+        return pd.DataFrame(columns=["Source", "Date", "Name", "Notes", "Snippet", "Score"])
+    search = _search_shard if FTS_ENABLED else _like_shard
+    want = offset + limit
+    factories = [session_factory(user)] if user else all_session_factories()
+    parts = fan_out(lambda f: search(f, user, query, start_date, end_date, want), factories)
+    rows = sorted(chain.from_iterable(parts), key=lambda r: -r["Score"])[offset:want]
+    return pd.DataFrame(rows, columns=["Source", "Date", "Name", "Notes", "Snippet", "Score"])
+
+# rolled-up periods count as sparkline points (their period means) and
+# fold their n/sum into the averages, like the other readers
+OVERVIEW_SQL = text("""
+WITH points AS (
+    SELECT user, entry_date, focus, cognitive_score, id
+    FROM entries
+    WHERE user IS NOT NULL AND entry_date IS NOT NULL
+    UNION ALL
+    SELECT user, period_start, 1.0 * focus_sum / NULLIF(focus_n, 0),
+           cognitive_score_sum / NULLIF(cognitive_score_n, 0), 0
+    FROM entry_rollups
+),
+ranked AS (
+    SELECT user, entry_date, focus, cognitive_score,
+           ROW_NUMBER() OVER (PARTITION BY user ORDER BY entry_date DESC, id DESC) AS rn
+    FROM points
+),
+totals AS (
+    SELECT user, SUM(n) AS n, SUM(raw_n) AS raw_n, COALESCE(MAX(max_id), 0) AS max_id,
+           1.0 * SUM(focus_sum) / NULLIF(SUM(focus_n), 0) AS avg_focus,
+           1.0 * SUM(cognitive_sum) / NULLIF(SUM(cognitive_n), 0) AS avg_cognitive,
+           1.0 * SUM(sleep_sum) / NULLIF(SUM(sleep_n), 0) AS avg_sleep,
+           1.0 * SUM(screen_sum) / NULLIF(SUM(screen_n), 0) AS avg_screen
+    FROM (
+        SELECT user, COUNT(*) AS n, COUNT(*) AS raw_n, MAX(id) AS max_id,
+               SUM(focus) AS focus_sum, COUNT(focus) AS focus_n,
+               SUM(cognitive_score) AS cognitive_sum, COUNT(cognitive_score) AS cognitive_n,
+               SUM(sleep_hours) AS sleep_sum, COUNT(sleep_hours) AS sleep_n,
+               SUM(screen_time) AS screen_sum, COUNT(screen_time) AS screen_n
+        FROM entries WHERE user IS NOT NULL GROUP BY user
+        UNION ALL
+        SELECT user, SUM(n), 0, NULL,
+               SUM(focus_sum), SUM(focus_n), SUM(cognitive_score_sum), SUM(cognitive_score_n),
+               SUM(sleep_hours_sum), SUM(sleep_hours_n), SUM(screen_time_sum), SUM(screen_time_n)
+        FROM entry_rollups GROUP BY user
+    )
+    GROUP BY user
+)
+SELECT r.user, r.entry_date, r.focus, r.cognitive_score, r.rn, t.n, t.raw_n, t.max_id,
+       t.avg_focus, t.avg_cognitive, t.avg_sleep, t.avg_screen
+FROM ranked r JOIN totals t ON t.user = r.user
+WHERE r.rn <= :last_n
+ORDER BY r.user, r.entry_date, r.rn DESC
+""")
+
+def _overview_shard(factory, last_n):
+    session = factory()
+    try:
+        return [dict(r._mapping) for r in session.execute(OVERVIEW_SQL, {"last_n": last_n})]
+    finally:
+        session.close()
+
+def query_overview(last_n=30):
+    """Last last_n entries per user plus whole-history card values, for every user in one grouped query.
+
+    One row per (user, point), where a rolled-up period is one point. n counts
+    every entry, rolled up or not; n, raw_n and max_id form the user's data
+    watermark (compaction lowers raw_n).
+    """
+    parts = fan_out(lambda f: _overview_shard(f, last_n))
+    df = pd.DataFrame(list(chain.from_iterable(parts)))
+    if not df.empty:
+        df["entry_date"] = df["entry_date"].map(_fix_date)
+    return df
+
+def _shard_users(factory, active_since=None):
+    session = factory()
+    try:
+        q = session.query(Entry.user)
+        # a user whose entries were all compacted only has rollups left
+        r = session.query(EntryRollup.user)
+        if active_since:
+            q = q.filter(Entry.entry_date >= _fix_date(active_since))
+            r = r.filter(EntryRollup.period_end >= _fix_date(active_since))
+        return [u[0] for u in q.union(r).all()]
+    finally:
+        session.close()
+
+def get_users(active_since=None):
+    """Every user with entries (raw or rolled up); active_since limits it to users with an entry on or after that date."""
+    users = chain.from_iterable(fan_out(lambda f: _shard_users(f, active_since)))
+    return [u for u in dict.fromkeys(users) if u is not None]
+
+def _shard_watermark(factory, user):
+    session = factory()
+    try:
+        out = []
+        for model in (Entry, Habit):
+            q = session.query(func.max(model.id), func.count(model.id))
+            if user:
+                q = q.filter(model.user==user)
+            mx, n = q.one()
+            out.extend([mx or 0, n or 0])
+        return out
+    finally:
+        session.close()
+
+def get_user_watermark(user=None):
+    # (max id, count) moves on every write, and the count drops when retention.py compacts
+    if user or not SHARDS:
+        return tuple(_shard_watermark(session_factory(user), user))
+    # ids are per shard; summing keeps the watermark moving on any shard's write
+    parts = fan_out(lambda f: _shard_watermark(f, None))
+    return tuple(sum(col) for col in zip(*parts))
+
+if SHARD_COUNT:
+    configure_shards(SHARD_COUNT)
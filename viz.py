@@ -88,3 +88,17 @@ def figure_mood_pie(df):
     ax.set_title("Mood Distribution")
     fig.tight_layout()
     return fig
+
+def figure_sparkline(df):
+    # tiny focus/cognitive lines for the overview grid; no axes, fixed 0-10 scale
+    fig = Figure(figsize=(2.4,0.7), dpi=100)
+    ax = fig.add_axes([0,0,1,1])
+    ax.set_axis_off()
+    ax.set_ylim(0,10.5)
+    if df is None or df.empty:
+        return fig
+    df = df.sort_values("Date")
+    x = np.arange(len(df))
+    ax.plot(x, pd.to_numeric(df["Focus"], errors="coerce"), linewidth=1.5)
+    ax.plot(x, pd.to_numeric(df["Cognitive Score"], errors="coerce"), linewidth=1.5, color="tab:green")
+    return fig